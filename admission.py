@@ -0,0 +1,116 @@
+# admission.py
+# ---------------------------------------------------------------------------
+# Admission control for CPU-heavy endpoint classes.
+#
+# Each class admits `limit` concurrent requests and lets at most `queue`
+# more wait, each for at most `deadline` seconds. Anything beyond that is
+# shed immediately with 503 + Retry-After instead of piling up in the
+# thread pool until every request times out, so cheap endpoints
+# (/portfolio/latest, /funds) stay responsive while generation is saturated.
+#
+# Per-class settings: ADMISSION_<CLASS>_LIMIT / _QUEUE / _DEADLINE
+# (e.g. ADMISSION_PORTFOLIO_LIMIT=8).
+# ---------------------------------------------------------------------------
+import os
+import math
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+from metrics import Gauge, Counter
+from auth_service import PASSWORD_HASH_WORKERS
+
+ADMISSION_IN_USE = Gauge("mf_admission_in_use", "Requests admitted and running, by endpoint class.", ["cls"])
+ADMISSION_QUEUE_DEPTH = Gauge("mf_admission_queue_depth", "Requests waiting for admission, by endpoint class.", ["cls"])
+ADMISSION_SHED = Counter("mf_admission_shed_total", "Requests rejected with 503, by endpoint class and reason.",
+                         ["cls", "reason"])
+
+
+class Overloaded(HTTPException):
+    def __init__(self, cls, reason, retry_after):
+        super().__init__(
+            status_code=503,
+            detail=f"Server busy ({cls}: {reason}), retry later",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class AdmissionController:
+    def __init__(self, name, limit, queue, deadline):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.deadline = deadline
+        self.in_use = 0
+        self.waiting = 0
+        self.service_time = 0.5   # EWMA of seconds per admitted request, for Retry-After
+        self._sem = None
+
+    def retry_after(self):
+        """Whole seconds until the current backlog should have drained."""
+        return max(1, math.ceil(self.service_time * (self.waiting + 1) / self.limit))
+
+    def _shed(self, reason):
+        ADMISSION_SHED.inc(cls=self.name, reason=reason)
+        raise Overloaded(self.name, reason, self.retry_after())
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.limit)   # Bound to the running loop on first use
+
+        if self.in_use >= self.limit and self.waiting >= self.queue:
+            self._shed("queue_full")
+
+        self.waiting += 1
+        ADMISSION_QUEUE_DEPTH.set(self.waiting, cls=self.name)
+        try:
+            # Not wait_for(): on 3.11 it can time out after acquire() succeeded and leak the permit
+            async with asyncio.timeout(self.deadline):
+                await self._sem.acquire()
+        except TimeoutError:
+            self._shed("deadline")
+        finally:
+            self.waiting -= 1
+            ADMISSION_QUEUE_DEPTH.set(self.waiting, cls=self.name)
+
+        self.in_use += 1
+        ADMISSION_IN_USE.set(self.in_use, cls=self.name)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.service_time = 0.8 * self.service_time + 0.2 * (time.perf_counter() - t0)
+            self.in_use -= 1
+            ADMISSION_IN_USE.set(self.in_use, cls=self.name)
+            self._sem.release()
+
+    def stats(self):
+        return {"limit": self.limit, "queue": self.queue, "deadline": self.deadline,
+                "in_use": self.in_use, "waiting": self.waiting}
+
+
+def _controller(name, limit, queue, deadline):
+    env = f"ADMISSION_{name.upper()}"
+    return AdmissionController(
+        name,
+        limit=int(os.getenv(f"{env}_LIMIT", limit)),
+        queue=int(os.getenv(f"{env}_QUEUE", queue)),
+        deadline=float(os.getenv(f"{env}_DEADLINE", deadline)),
+    )
+
+
+_cpu = int(os.getenv("CPU_WORKERS", 4))
+_hash = max(1, PASSWORD_HASH_WORKERS)   # One login per hashing process; the rest wait here, not in the pool
+
+# Endpoint classes: portfolio = /recommend, chat = /chat/message, auth = password hashing
+CONTROLLERS = {
+    "portfolio": _controller("portfolio", limit=_cpu, queue=2 * _cpu, deadline=2.0),
+    "chat": _controller("chat", limit=_cpu, queue=2 * _cpu, deadline=2.0),
+    "auth": _controller("auth", limit=_hash, queue=4 * _cpu, deadline=3.0),
+}
+
+
+def admit(cls):
+    """`async with admit("portfolio"): ...` — raises Overloaded (503) when the class is saturated."""
+    return CONTROLLERS[cls].slot()
@@ -1,14 +1,40 @@
+import os
+import hmac
+import time
+import asyncio
+import functools
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from metrics import AUTH_SECONDS, CACHE_REQUESTS
 
 # SECRET_KEY should be in env, using hardcoded for MVP
 SECRET_KEY = "supersecretkey"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))  # Verified tokens kept in memory
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # Operator-only features (request profiling); disabled when unset
 
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# Password hashing cost (pbkdf2_sha256 rounds). Hashes with any other cost are
+# re-hashed on the user's next successful login, so it can be raised (or lowered) any time.
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", 29000))
+# Hashing runs in this many worker processes, off the event loop and off the GIL of the
+# API process, so a login storm can't starve /recommend; 0 = thread in this process.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+
+@functools.lru_cache(maxsize=None)
+def _context(rounds):
+    return CryptContext(
+        schemes=["pbkdf2_sha256"], deprecated="auto",
+        pbkdf2_sha256__default_rounds=rounds,
+        pbkdf2_sha256__min_desired_rounds=rounds,
+        pbkdf2_sha256__max_desired_rounds=rounds,
+    )
 
 from pydantic import BaseModel
 
@@ -16,11 +42,54 @@ class Token(BaseModel):
     access_token: str
     token_type: str
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+def is_admin_token(value):
+    return bool(ADMIN_TOKEN and value) and hmac.compare_digest(str(value), ADMIN_TOKEN)
+
+# --- Hashing pool (module-level functions so they pickle into the worker processes) ---
+
+def _hash(password, rounds):
+    return _context(rounds).hash(password)
+
+def _verify_and_update(password, hashed, rounds):
+    """(verified, new_hash): new_hash is set when `hashed` doesn't use `rounds`."""
+    return _context(rounds).verify_and_update(password, hashed)
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
+def get_hash_pool(workers=None):
+    """Process pool for hashing; created on first use (spawned, so no fork of a threaded server)."""
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            _hash_pool = ProcessPoolExecutor(
+                max_workers=workers or PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _hash_pool
+
+def shutdown_hash_pool():
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is not None:
+            _hash_pool.shutdown(wait=False, cancel_futures=True)
+            _hash_pool = None
+
+async def _run_hashing(fn, *args):
+    if PASSWORD_HASH_WORKERS <= 0:
+        return await asyncio.to_thread(fn, *args)
+    return await asyncio.get_running_loop().run_in_executor(get_hash_pool(), fn, *args)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def hash_password_async(password):
+    with AUTH_SECONDS.time(op='hash_password'):
+        return await _run_hashing(_hash, password, PASSWORD_HASH_ROUNDS)
+
+async def verify_password_async(plain_password, hashed_password):
+    """
+    (verified, new_hash). new_hash is not None when the stored hash uses a different
+    cost than PASSWORD_HASH_ROUNDS and should replace it.
+    """
+    with AUTH_SECONDS.time(op='verify_password'):
+        return await _run_hashing(_verify_and_update, plain_password, hashed_password, PASSWORD_HASH_ROUNDS)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -32,10 +101,40 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def decode_token(token: str):
+# token -> verified claims, evicted LRU or once the token's "exp" has passed
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+def decode_claims(token: str):
+    """
+    Verified claims of `token` ("sub" email, "uid" user id, "pv" profile version, "exp"),
+    or None if invalid/expired. Signature checks are cached per token until expiry.
+    """
+    now = time.time()
+    with _token_cache_lock:
+        claims = _token_cache.get(token)
+        if claims is not None:
+            if claims.get("exp", 0) > now:
+                _token_cache.move_to_end(token)
+                CACHE_REQUESTS.inc(cache='token', result='hit')
+                return claims
+            del _token_cache[token]
+
+    CACHE_REQUESTS.inc(cache='token', result='miss')
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        return email
+        with AUTH_SECONDS.time(op='decode_token'):
+            claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         return None
+    if claims.get("sub") is None:
+        return None
+
+    with _token_cache_lock:
+        _token_cache[token] = claims
+        if len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return claims
+
+def decode_token(token: str):
+    claims = decode_claims(token)
+    return claims.get("sub") if claims else None
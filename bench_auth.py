@@ -0,0 +1,82 @@
+# bench_auth.py
+# ---------------------------------------------------------------------------
+# Login throughput vs password hash cost (pbkdf2_sha256 rounds).
+#
+# For each cost, a burst of logins (password verifications) runs the way the
+# API runs them: on the hashing process pool, and for comparison on a thread
+# in this process. Besides logins/s we report event-loop lag, i.e. how long
+# an unrelated request (/recommend, /portfolio/latest) would wait while the
+# burst is in progress.
+#
+# Runs fully offline (no DB / network needed).
+#
+# Run: python bench_auth.py [logins_per_run] [rounds,rounds,...] [pool_workers]
+# ---------------------------------------------------------------------------
+import os
+import sys
+import time
+import asyncio
+import numpy as np
+
+from auth_service import _hash, _verify_and_update, get_hash_pool, shutdown_hash_pool, PASSWORD_HASH_WORKERS
+
+DEFAULT_ROUNDS = (10000, 29000, 100000, 300000)
+
+
+async def loop_lag(stop, samples, interval=0.005):
+    """Oversleep of a periodic timer = how long the event loop was blocked."""
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - t0 - interval)
+
+
+async def burst(run, hashed, rounds, logins):
+    lags, stop = [], asyncio.Event()
+    sampler = asyncio.create_task(loop_lag(stop, lags))
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*[run(_verify_and_update, "correct horse", hashed, rounds) for _ in range(logins)])
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await sampler
+    assert all(ok for ok, _ in results)
+    lag_ms = np.array(lags or [0.0]) * 1000
+    return {'logins_s': logins / elapsed, 'lag_p99_ms': np.percentile(lag_ms, 99), 'lag_max_ms': lag_ms.max()}
+
+
+async def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rounds_list = [int(r) for r in sys.argv[2].split(",")] if len(sys.argv) > 2 else DEFAULT_ROUNDS
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else max(1, PASSWORD_HASH_WORKERS)
+
+    pool = get_hash_pool(workers)
+    loop = asyncio.get_running_loop()
+
+    async def on_pool(fn, *args):
+        return await loop.run_in_executor(pool, fn, *args)
+
+    async def on_thread(fn, *args):
+        return await asyncio.to_thread(fn, *args)
+
+    # Spawn the workers and import passlib in them before timing anything
+    await asyncio.gather(*[on_pool(_hash, "warm-up", 1000) for _ in range(workers)])
+
+    print(f"{logins} logins per run, {workers} hashing processes, {os.cpu_count()} CPUs\n")
+    print(f"{'':>18}{'--------- pool ---------':>34}{'-------- thread --------':>34}")
+    print(f"{'rounds':>8}{'hash':>10}" + f"{'logins':>14}{'lag p99':>10}{'lag max':>10}" * 2)
+    for rounds in rounds_list:
+        hashed = _hash("correct horse", rounds)
+        t0 = time.perf_counter()
+        _verify_and_update("correct horse", hashed, rounds)
+        single_ms = (time.perf_counter() - t0) * 1000
+
+        p = await burst(on_pool, hashed, rounds, logins)
+        t = await burst(on_thread, hashed, rounds, logins)
+        print(f"{rounds:>8}{single_ms:>8.1f}ms" + "".join(
+            f"{r['logins_s']:>12.0f}/s{r['lag_p99_ms']:>8.1f}ms{r['lag_max_ms']:>8.1f}ms" for r in (p, t)))
+
+    shutdown_hash_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
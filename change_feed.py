@@ -0,0 +1,126 @@
+# change_feed.py
+# ---------------------------------------------------------------------------
+# Cross-worker cache invalidation over Postgres LISTEN/NOTIFY.
+#
+# Batch jobs that change fund data (compute_features, fetch_aum,
+# fix_categories, etl_fetch_index) call notify_change() inside the
+# transaction that wrote it, so the NOTIFY is delivered on commit and never
+# for a rolled-back write. Each API worker holds one LISTEN connection and
+# dispatches every notification to the handlers registered with subscribe().
+# Portfolio saves (memory_service) use the same feed to keep each worker's
+# latest-portfolio cache current.
+#
+# While the listener is connected the version polls in snapshot_cache and
+# score_service only run every CHANGE_FEED_POLL_SECONDS as a safety net;
+# after a reconnect everything is invalidated, since notifications sent
+# while disconnected are lost.
+# ---------------------------------------------------------------------------
+import os
+import json
+import time
+import asyncio
+from sqlalchemy import text
+
+CHANNEL = os.getenv("CHANGE_FEED_CHANNEL", "mf_data_changed")
+CHANGE_FEED_ENABLED = os.getenv("CHANGE_FEED", "1") != "0"
+CHANGE_FEED_POLL_SECONDS = float(os.getenv("CHANGE_FEED_POLL_SECONDS", 900))   # Safety-net poll while listening
+RECONNECT_SECONDS = float(os.getenv("CHANGE_FEED_RECONNECT_SECONDS", 5))
+
+# What a change touches; handlers decide what to drop for each
+FEATURES = "features"   # fund_features / fund_scores / published scored snapshot
+FUNDS = "funds"         # funds metadata (aum_cr, category, ...)
+MARKET = "market"       # market_index_history
+PORTFOLIOS = "portfolios"   # user_portfolios; payload["users"] lists whose (None = anyone's)
+
+_handlers = []
+_state = {"listening": False, "received": 0, "last": None}
+
+
+NOTIFY_SQL = text("SELECT pg_notify(:channel, :payload)")
+
+
+def _notify_params(source, kinds, version, users):
+    payload = {"source": source, "kinds": list(kinds), "version": version, "at": time.time()}
+    if users is not None:
+        payload["users"] = list(users)
+    return {"channel": CHANNEL, "payload": json.dumps(payload)}
+
+
+def notify_change(conn, source, kinds, version=None, users=None):
+    """
+    Queue a NOTIFY on `conn` (a SQLAlchemy connection inside a transaction);
+    Postgres delivers it to listeners when that transaction commits.
+    """
+    conn.execute(NOTIFY_SQL, _notify_params(source, kinds, version, users))
+
+
+async def notify_change_async(conn, source, kinds, version=None, users=None):
+    """notify_change() on an async connection (API request path)."""
+    await conn.execute(NOTIFY_SQL, _notify_params(source, kinds, version, users))
+
+
+def subscribe(handler):
+    """Call `handler(payload)` for every change; payload["kinds"] is None after a reconnect (assume everything)."""
+    _handlers.append(handler)
+    return handler
+
+
+def is_listening():
+    return _state["listening"]
+
+
+def poll_interval(default):
+    """`default` normally; stretched to CHANGE_FEED_POLL_SECONDS while notifications are arriving."""
+    return max(default, CHANGE_FEED_POLL_SECONDS) if _state["listening"] else default
+
+
+def stats():
+    return {"listening": _state["listening"], "received": _state["received"], "last": _state["last"]}
+
+
+def _dispatch(payload):
+    for handler in _handlers:
+        try:
+            handler(payload)
+        except Exception as e:
+            print(f"Change feed handler {handler.__name__} failed: {e}")
+
+
+def _on_notify(connection, pid, channel, raw):
+    try:
+        payload = json.loads(raw)
+    except ValueError:
+        payload = {"source": "unknown", "kinds": None, "version": None, "at": time.time()}
+    _state["received"] += 1
+    _state["last"] = payload
+    _dispatch(payload)
+
+
+async def listen_forever():
+    """LISTEN on CHANNEL with a dedicated asyncpg connection, reconnecting on failure. Run as a task."""
+    import asyncpg
+    from sqlalchemy.engine import make_url
+    from async_db import DB_URL
+
+    # asyncpg only takes plain postgresql:// DSNs, not driver-qualified URLs like postgresql+psycopg2://
+    dsn = make_url(DB_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(dsn)
+            await conn.add_listener(CHANNEL, _on_notify)
+            _state["listening"] = True
+            # Anything may have changed while we weren't listening
+            _dispatch({"source": "reconnect", "kinds": None, "version": None, "at": time.time()})
+            print(f"Listening for data changes on '{CHANNEL}'")
+            while not conn.is_closed():
+                await asyncio.sleep(RECONNECT_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Change feed disconnected, retrying in {RECONNECT_SECONDS:.0f}s: {e}")
+        finally:
+            _state["listening"] = False
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        await asyncio.sleep(RECONNECT_SECONDS)
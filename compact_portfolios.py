@@ -0,0 +1,50 @@
+from sqlalchemy import text
+from memory_service import engine, composition_of
+
+# Moves portfolio snapshots saved before compositions were deduplicated onto
+# portfolio_compositions (see memory_service.composition_of). Idempotent; run
+# in batches so it can go while the API is up. VACUUM FULL user_portfolios
+# afterwards to give the space back to the OS.
+BATCH_SIZE = 1000
+
+LEGACY_ROWS_SQL = text("""
+    SELECT id, portfolio_data FROM user_portfolios
+    WHERE composition_hash IS NULL AND portfolio_data IS NOT NULL
+    ORDER BY id
+    LIMIT :n
+""")
+
+INSERT_COMPOSITION_SQL = text("""
+    INSERT INTO portfolio_compositions (hash, composition)
+    VALUES (:chash, CAST(:comp AS JSONB))
+    ON CONFLICT (hash) DO NOTHING
+""")
+
+POINT_ROW_SQL = text("""
+    UPDATE user_portfolios
+    SET composition_hash = :chash, amount_scale = :scale, portfolio_data = NULL
+    WHERE id = :id
+""")
+
+def compact():
+    import json
+    moved, hashes = 0, set()
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(LEGACY_ROWS_SQL, {"n": BATCH_SIZE}).fetchall()
+            if not rows:
+                break
+            compositions, pointers = {}, []
+            for row_id, data in rows:
+                chash, composition, scale = composition_of(data)
+                compositions[chash] = json.dumps(composition)
+                pointers.append({"id": row_id, "chash": chash, "scale": scale})
+            conn.execute(INSERT_COMPOSITION_SQL, [{"chash": h, "comp": c} for h, c in compositions.items()])
+            conn.execute(POINT_ROW_SQL, pointers)
+        moved += len(rows)
+        hashes.update(compositions)
+        print(f"Compacted {moved} snapshots into {len(hashes)} compositions...")
+    print(f"Done: {moved} snapshots moved")
+
+if __name__ == "__main__":
+    compact()
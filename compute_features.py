@@ -137,6 +137,26 @@ def main():
             if metrics:
                 upsert_features(engine, fid, as_of, metrics)
 
+    # Covariance model for the latest snapshot (cached on disk for the API)
+    from risk_model import build_risk_model
+    build_risk_model(engine)
+
+    # Scores/tiers of the latest snapshot, for filtering and paging /funds in SQL,
+    # and the scored universe published for API workers to attach to
+    from score_service import load_latest_features, compute_scores, save_scores
+    from snapshot_store import write_snapshot
+    from change_feed import notify_change, FEATURES
+    df = load_latest_features(engine)
+    if not df.empty:
+        as_of = df['as_of_date'].max().date()
+        scored = compute_scores(df.copy(), {})
+        n = save_scores(engine, scored, as_of)
+        print(f"Saved scores for {n} funds.")
+        pointer = write_snapshot({"features": df, "scored": scored}, str(as_of))
+        # Tell running API workers to drop cached fund responses and attach the new version
+        with engine.begin() as conn:
+            notify_change(conn, "compute_features", [FEATURES], pointer["version"])
+
 
 if __name__ == "__main__":
     main()
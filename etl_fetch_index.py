@@ -0,0 +1,21 @@
+# etl_fetch_index.py
+# Daily incremental append of market index closes (Nifty 50, Nifty Midcap,
+# G-Sec proxy) into market_index_history. Only sessions after the last stored
+# date are fetched. The API also syncs on its market-status refresh, so this
+# is only needed to keep history current when the API isn't running.
+#
+# Run frequency: once a day after market close.
+from market_service import get_index_store, fetch_closes
+from change_feed import notify_change, MARKET
+
+if __name__ == "__main__":
+    store = get_index_store()
+    added = store.sync(fetch_closes)
+    if any(added.values()):
+        # Running API workers reload the history and recompute market status
+        with store.engine.begin() as conn:
+            notify_change(conn, "etl_fetch_index", [MARKET])
+    for key, n in added.items():
+        print(f"{key}: {n} new closes")
+    for key, ind in store.indicators().items():
+        print(f"{key}: {ind}")
@@ -0,0 +1,63 @@
+# fast_json.py
+# JSON encoding for large, trusted responses (/recommend, cached fund bodies).
+# Uses orjson when installed (several times faster than the stdlib encoder and
+# handles numpy scalars/arrays natively); falls back to json otherwise.
+import json
+import math
+import datetime
+import decimal
+import numpy as np
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _finite(obj):
+    """Copy of obj with NaN/Infinity replaced by None, as orjson writes them (null)."""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {k: _finite(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(v) for v in obj]
+    if isinstance(obj, (decimal.Decimal, np.generic, np.ndarray)):
+        return _finite(_default(obj))
+    return obj
+
+
+def dumps(obj):
+    """Compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    try:
+        text = json.dumps(obj, default=_default, separators=(",", ":"), ensure_ascii=False, allow_nan=False)
+    except ValueError:
+        # Only payloads that contain a non-finite float pay for the second pass.
+        text = json.dumps(_finite(obj), default=_default, separators=(",", ":"), ensure_ascii=False)
+    return text.encode()
+
+
+class FastJSONResponse(Response):
+    """
+    Serializes content as-is. Returning it from a route skips FastAPI's
+    response_model validation, so use it only for internally built data.
+    """
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
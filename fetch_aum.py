@@ -26,6 +26,7 @@ import sys
 import pandas as pd
 from sqlalchemy import create_engine, text
 from pathlib import Path
+from change_feed import notify_change, FUNDS
 
 DB_URL = os.getenv("DB_URL")
 if DB_URL is None:
@@ -116,6 +117,9 @@ def update_aum_in_db(df_aum: pd.DataFrame):
                 updated += 1
             else:
                 skipped += 1
+        if updated:
+            # Delivered to the API on commit: AUM filters and scores change
+            notify_change(conn, "fetch_aum", [FUNDS])
 
     return updated, skipped
 
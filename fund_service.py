@@ -0,0 +1,121 @@
+# fund_service.py
+# ---------------------------------------------------------------------------
+# Fund universe listing for /funds: filters, keyset (cursor) pagination and
+# an NDJSON export that streams rows from a server-side cursor.
+#
+# Keyset pages stay O(page) however deep the client goes (no OFFSET scans):
+#   sort=fund_id -> WHERE fund_id > :last                     ORDER BY fund_id
+#   sort=score   -> WHERE (score, fund_id) after last row     ORDER BY score DESC, fund_id
+# Scores/tiers come from fund_scores (latest snapshot, see init_funds.sql).
+# ---------------------------------------------------------------------------
+import json
+import base64
+from sqlalchemy import text
+from async_db import get_async_engine
+
+FUND_SORTS = ('fund_id', 'score')
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 1000
+
+LATEST_SCORES = "s.as_of_date = (SELECT MAX(as_of_date) FROM fund_scores)"
+
+
+def encode_cursor(row, sort):
+    key = [row['score'], row['fund_id']] if sort == 'score' else [row['fund_id']]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if sort == 'score':
+            score, fund_id = key
+            return float(score), str(fund_id)
+        (fund_id,) = key
+        return (str(fund_id),)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _query(filters, sort, cursor=None, limit=None):
+    """SQL + params for the filtered universe, in keyset order, after `cursor`."""
+    if sort not in FUND_SORTS:
+        raise ValueError(f"sort must be one of {list(FUND_SORTS)}")
+
+    where, params = [], {}
+    if filters.get('category'):
+        where.append("f.category = :category")
+        params['category'] = filters['category']
+    if filters.get('min_aum') is not None:
+        where.append("f.aum_cr >= :min_aum")
+        params['min_aum'] = filters['min_aum']
+    if filters.get('max_aum') is not None:
+        where.append("f.aum_cr <= :max_aum")
+        params['max_aum'] = filters['max_aum']
+    if filters.get('tier') is not None:
+        where.append("s.tier = :tier")
+        params['tier'] = filters['tier']
+    if filters.get('min_score') is not None:
+        where.append("s.score >= :min_score")
+        params['min_score'] = filters['min_score']
+    if filters.get('max_score') is not None:
+        where.append("s.score <= :max_score")
+        params['max_score'] = filters['max_score']
+
+    # Score filters/order only make sense for scored funds
+    scored_only = sort == 'score' or any(filters.get(k) is not None for k in ('tier', 'min_score', 'max_score'))
+    join = "JOIN" if scored_only else "LEFT JOIN"
+
+    if cursor:
+        key = decode_cursor(cursor, sort)
+        if sort == 'score':
+            where.append("(s.score < :c_score OR (s.score = :c_score AND f.fund_id > :c_fid))")
+            params['c_score'], params['c_fid'] = key
+        else:
+            where.append("f.fund_id > :c_fid")
+            params['c_fid'] = key[0]
+
+    order = "s.score DESC, f.fund_id" if sort == 'score' else "f.fund_id"
+    sql = f"""
+        SELECT f.fund_id, f.fund_name, f.category, f.aum_cr, s.score, s.tier
+        FROM funds f
+        {join} fund_scores s ON s.fund_id = f.fund_id AND {LATEST_SCORES}
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY {order}
+    """
+    if limit is not None:
+        sql += " LIMIT :limit"
+        params['limit'] = limit
+    return text(sql), params
+
+
+def _row(row):
+    m = row._mapping
+    return {
+        "fund_id": m['fund_id'],
+        "fund_name": m['fund_name'],
+        "category": m['category'],
+        "aum_cr": float(m['aum_cr']) if m['aum_cr'] is not None else None,
+        "score": float(m['score']) if m['score'] is not None else None,
+        "tier": m['tier'],
+    }
+
+
+async def list_funds_page(filters, sort='fund_id', cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """One page: {"items": [...], "next_cursor": str | None}."""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    sql, params = _query(filters, sort, cursor, limit + 1)   # One extra row tells us if there's more
+    async with get_async_engine().connect() as conn:
+        items = [_row(r) for r in await conn.execute(sql, params)]
+    next_cursor = encode_cursor(items[limit - 1], sort) if len(items) > limit else None
+    return {"items": items[:limit], "next_cursor": next_cursor}
+
+
+async def stream_funds_ndjson(filters, sort='fund_id'):
+    """Every matching fund as one JSON line, fetched in STREAM_BATCH_SIZE batches."""
+    sql, params = _query(filters, sort)
+    async with get_async_engine().connect() as conn:
+        result = await conn.stream(sql.execution_options(yield_per=STREAM_BATCH_SIZE), params)
+        async for rows in result.partitions():
+            yield "".join(json.dumps(_row(r)) + "\n" for r in rows).encode()
@@ -0,0 +1,221 @@
+# index_store.py
+# ---------------------------------------------------------------------------
+# Local history of market index closes (market_index_history table) with
+# rolling indicator state per index.
+#
+# The store is hydrated once from Postgres, then each new daily close is
+# appended (DB + memory) and updates SMA-200 and 30-day volatility in O(1),
+# so get_market_status never re-downloads or recomputes a year of history.
+# ---------------------------------------------------------------------------
+import math
+import threading
+from collections import deque
+from datetime import date, timedelta
+from sqlalchemy import text
+
+# Benchmarks tracked for phase detection: key -> Yahoo symbol
+MARKET_INDICES = {
+    'NIFTY50': '^NSEI',                   # Nifty 50
+    'NIFTY_MIDCAP': '^NSEMDCP50',         # Nifty Midcap 50
+    'GSEC_BOND': 'GILT5YBEES.NS',         # Nifty 5yr Benchmark G-Sec ETF (bond index proxy)
+}
+
+SMA_WINDOW = 200
+VOL_WINDOW = 30
+BOOTSTRAP_DAYS = 400   # Calendar days fetched when an index has no history yet
+
+
+class RollingIndicators:
+    """
+    SMA over the last SMA_WINDOW closes and annualised stdev of the last
+    VOL_WINDOW daily returns, maintained with running sums (O(1) per close).
+    """
+    def __init__(self):
+        self.closes = deque(maxlen=SMA_WINDOW)
+        self.returns = deque(maxlen=VOL_WINDOW)
+        self.close_sum = 0.0
+        self.ret_sum = 0.0
+        self.ret_sq_sum = 0.0
+        self.last_date = None
+
+    def update(self, trade_date, close):
+        close = float(close)
+        if self.closes:
+            r = close / self.closes[-1] - 1
+            if len(self.returns) == self.returns.maxlen:
+                old = self.returns[0]
+                self.ret_sum -= old
+                self.ret_sq_sum -= old * old
+            self.returns.append(r)
+            self.ret_sum += r
+            self.ret_sq_sum += r * r
+        if len(self.closes) == self.closes.maxlen:
+            self.close_sum -= self.closes[0]
+        self.closes.append(close)
+        self.close_sum += close
+        self.last_date = trade_date
+
+    @property
+    def last_close(self):
+        return self.closes[-1] if self.closes else None
+
+    @property
+    def sma_200(self):
+        # Short history: average of what we have (same fallback as the old 1y download)
+        return self.close_sum / len(self.closes) if self.closes else None
+
+    @property
+    def volatility(self):
+        """Annualised volatility in %, sample stdev (ddof=1) like pandas."""
+        n = len(self.returns)
+        if n < 2:
+            return None
+        var = (self.ret_sq_sum - self.ret_sum * self.ret_sum / n) / (n - 1)
+        return math.sqrt(max(var, 0.0)) * math.sqrt(252) * 100
+
+    @property
+    def deviation_200(self):
+        sma = self.sma_200
+        return (self.last_close - sma) / sma if sma else None
+
+    def snapshot(self):
+        return {
+            "current_price": self.last_close,
+            "sma_200": self.sma_200,
+            "deviation_200": self.deviation_200,
+            "volatility": self.volatility,
+            "as_of": str(self.last_date) if self.last_date else None,
+        }
+
+    def preview(self, trade_date, close):
+        """
+        Snapshot as if `close` were appended, without mutating state (O(1)).
+        Used for today's in-progress session, which is not stored until it closes.
+        """
+        close = float(close)
+        full = len(self.closes) == self.closes.maxlen
+        n_close = len(self.closes) + (0 if full else 1)
+        close_sum = self.close_sum - (self.closes[0] if full else 0.0) + close
+        sma = close_sum / n_close
+
+        vol = None
+        ret_sum, ret_sq_sum, n_ret = self.ret_sum, self.ret_sq_sum, len(self.returns)
+        if self.closes:
+            r = close / self.closes[-1] - 1
+            if n_ret == self.returns.maxlen:
+                old = self.returns[0]
+                ret_sum -= old
+                ret_sq_sum -= old * old
+                n_ret -= 1
+            ret_sum += r
+            ret_sq_sum += r * r
+            n_ret += 1
+        if n_ret >= 2:
+            var = (ret_sq_sum - ret_sum * ret_sum / n_ret) / (n_ret - 1)
+            vol = math.sqrt(max(var, 0.0)) * math.sqrt(252) * 100
+
+        return {
+            "current_price": close,
+            "sma_200": sma,
+            "deviation_200": (close - sma) / sma if sma else None,
+            "volatility": vol,
+            "as_of": str(trade_date),
+        }
+
+
+class IndexHistoryStore:
+    def __init__(self, engine, indices=None):
+        self.engine = engine
+        self.indices = dict(indices or MARKET_INDICES)
+        self.state = {key: RollingIndicators() for key in self.indices}
+        self.live = {}  # key -> (date, close) of today's unfinished session
+        self.lock = threading.Lock()
+        self.loaded = False
+
+    def load(self):
+        """Hydrate rolling state from the last SMA_WINDOW closes of every index (one query)."""
+        sql = text("""
+            SELECT symbol, trade_date, close FROM (
+                SELECT symbol, trade_date, close,
+                       ROW_NUMBER() OVER (PARTITION BY symbol ORDER BY trade_date DESC) AS rn
+                FROM market_index_history
+                WHERE symbol = ANY(:symbols)
+            ) h
+            WHERE rn <= :n
+            ORDER BY symbol, trade_date
+        """)
+        by_symbol = {sym: key for key, sym in self.indices.items()}
+        with self.engine.connect() as conn:
+            rows = conn.execute(sql, {'symbols': list(by_symbol), 'n': SMA_WINDOW}).fetchall()
+
+        state = {key: RollingIndicators() for key in self.indices}
+        for symbol, trade_date, close in rows:
+            state[by_symbol[symbol]].update(trade_date, close)
+        with self.lock:
+            self.state = state
+            self.loaded = True
+
+    def append(self, key, closes):
+        """
+        Append new (trade_date, close) pairs for index `key`.
+        Only closes after the last stored date are applied; returns count applied.
+        """
+        with self.lock:
+            last = self.state[key].last_date
+        new = sorted((d, float(c)) for d, c in closes if last is None or d > last)
+        if not new:
+            return 0
+
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO market_index_history (symbol, trade_date, close)
+                VALUES (:sym, :d, :c)
+                ON CONFLICT (symbol, trade_date) DO UPDATE SET close = EXCLUDED.close
+            """), [{'sym': self.indices[key], 'd': d, 'c': c} for d, c in new])
+
+        with self.lock:
+            ind = self.state[key]
+            for d, c in new:
+                if ind.last_date is None or d > ind.last_date:
+                    ind.update(d, c)
+        return len(new)
+
+    def sync(self, fetch_closes):
+        """
+        Incremental update of every index. `fetch_closes(symbol, start)` returns an
+        iterable of (date, close) from `start` (inclusive) onwards.
+
+        Only completed sessions (before today) are stored; today's close is kept
+        as a live value so an intraday price never gets frozen into history.
+        """
+        if not self.loaded:
+            self.load()
+        added = {}
+        for key, symbol in self.indices.items():
+            last = self.state[key].last_date
+            start = last + timedelta(days=1) if last else date.today() - timedelta(days=BOOTSTRAP_DAYS)
+            if start > date.today():
+                continue
+            try:
+                closes = list(fetch_closes(symbol, start))
+                today = [(d, c) for d, c in closes if d >= date.today()]
+                added[key] = self.append(key, [(d, c) for d, c in closes if d < date.today()])
+                with self.lock:
+                    if today:
+                        self.live[key] = max(today)
+                    else:
+                        self.live.pop(key, None)
+            except Exception as e:
+                print(f"Error updating index history for {symbol}: {e}")
+        return added
+
+    def indicators(self):
+        """Latest indicator snapshot per index (including today's live close if any)."""
+        with self.lock:
+            out = {}
+            for key, ind in self.state.items():
+                if key in self.live:
+                    out[key] = ind.preview(*self.live[key])
+                elif ind.last_close is not None:
+                    out[key] = ind.snapshot()
+            return out
@@ -0,0 +1,39 @@
+-- Core fund data: scheme metadata, daily NAVs and the monthly feature snapshots
+-- computed from them (compute_features.py). Apply before init_funds.sql.
+CREATE TABLE IF NOT EXISTS funds (
+    fund_id VARCHAR PRIMARY KEY,           -- AMFI scheme code
+    fund_name TEXT,
+    category VARCHAR(100),                 -- Set by fix_categories.py
+    aum_cr NUMERIC(14,2),                  -- Set by fetch_aum.py
+    expense_ratio NUMERIC(6,3),
+    top10_concentration NUMERIC(6,3),
+    rating VARCHAR(20),
+    turnover NUMERIC(8,3)
+);
+
+CREATE TABLE IF NOT EXISTS navs (
+    fund_id VARCHAR NOT NULL,
+    nav_date DATE NOT NULL,
+    nav NUMERIC(14,4),
+    PRIMARY KEY (fund_id, nav_date)
+);
+
+CREATE TABLE IF NOT EXISTS fund_features (
+    fund_id VARCHAR NOT NULL,
+    as_of_date DATE NOT NULL,
+    ret_1m DOUBLE PRECISION,
+    ret_3m DOUBLE PRECISION,
+    ret_6m DOUBLE PRECISION,
+    ret_12m DOUBLE PRECISION,
+    ret_36m DOUBLE PRECISION,
+    ret_60m DOUBLE PRECISION,
+    ret_consistency DOUBLE PRECISION,
+    ann_return DOUBLE PRECISION,
+    ann_vol DOUBLE PRECISION,
+    sharpe DOUBLE PRECISION,
+    max_drawdown DOUBLE PRECISION,
+    pct_pos_months_36 DOUBLE PRECISION,
+    manager_tenure_years DOUBLE PRECISION,   -- Only set by seed_features.py
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (fund_id, as_of_date)
+);
@@ -0,0 +1,19 @@
+-- Persisted fund scores per features snapshot (written by compute_features.py)
+-- so /funds can filter and keyset-paginate on score/tier in SQL.
+CREATE TABLE IF NOT EXISTS fund_scores (
+    fund_id VARCHAR NOT NULL,
+    as_of_date DATE NOT NULL,
+    score NUMERIC(5,2) NOT NULL,      -- ConsistencyScore, 0-100
+    tier SMALLINT NOT NULL,           -- 1 = Elite, 2 = Strong, 3 = Rest
+    PRIMARY KEY (as_of_date, fund_id)
+);
+
+-- Keyset order for sort=score: (score DESC, fund_id) within a snapshot
+CREATE INDEX IF NOT EXISTS fund_scores_rank_idx ON fund_scores (as_of_date, score DESC, fund_id);
+
+-- /funds filters; sort=fund_id walks the funds primary key
+CREATE INDEX IF NOT EXISTS funds_category_idx ON funds (category, fund_id);
+CREATE INDEX IF NOT EXISTS funds_aum_idx ON funds (aum_cr);
+
+-- MAX(as_of_date) lookups (latest snapshot, snapshot version polling)
+CREATE INDEX IF NOT EXISTS fund_features_as_of_idx ON fund_features (as_of_date);
@@ -0,0 +1,7 @@
+-- Daily closes of market indices used for phase detection (see index_store.py)
+CREATE TABLE IF NOT EXISTS market_index_history (
+    symbol VARCHAR(32) NOT NULL,
+    trade_date DATE NOT NULL,
+    close NUMERIC(14,4) NOT NULL,
+    PRIMARY KEY (symbol, trade_date)
+);
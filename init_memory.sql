@@ -15,10 +15,68 @@ CREATE TABLE IF NOT EXISTS user_portfolios (
 );
 
 -- Table to verify User Interactions (Feedback Loop)
+-- Daily range partitions (interaction_logs_pYYYYMMDD) are created ahead, rolled up and dropped
+-- after the retention period by maintain_interaction_logs.py, which also converts a table
+-- created before partitioning. There is no default partition (it would rule out DETACH
+-- CONCURRENTLY), so the first two weeks are created here and an insert for a day without
+-- a partition fails: run the job at least weekly.
 CREATE TABLE IF NOT EXISTS interaction_logs (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     user_id INTEGER REFERENCES users(id),
     action_type VARCHAR(50), -- 'generate', 'accept', 'reject', 'click_fund'
     details JSONB,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+DO $$
+DECLARE
+    d DATE;
+BEGIN
+    -- A legacy table is converted, and an old default partition retired, by the job instead
+    IF (SELECT relkind FROM pg_class WHERE oid = 'interaction_logs'::regclass) = 'p'
+       AND to_regclass('interaction_logs_default') IS NULL THEN
+        FOR d IN SELECT CAST(g AS DATE) FROM generate_series(CURRENT_DATE, CURRENT_DATE + 14, INTERVAL '1 day') g LOOP
+            EXECUTE 'CREATE TABLE IF NOT EXISTS ' || quote_ident('interaction_logs_p' || to_char(d, 'YYYYMMDD'))
+                 || ' PARTITION OF interaction_logs FOR VALUES FROM (' || quote_literal(d) || ') TO ('
+                 || quote_literal(d + 1) || ')';
+        END LOOP;
+    END IF;
+END $$;
+
+-- Actions per user, type and day (maintain_interaction_logs.py); analytics read this, not the raw logs
+CREATE TABLE IF NOT EXISTS interaction_daily_rollups (
+    day DATE NOT NULL,
+    user_id INTEGER NOT NULL,
+    action_type VARCHAR(50) NOT NULL,
+    actions INTEGER NOT NULL,
+    PRIMARY KEY (day, user_id, action_type)
+);
+CREATE INDEX IF NOT EXISTS interaction_daily_rollups_user_idx ON interaction_daily_rollups (user_id, day);
+
+-- Portfolio compositions stored once, keyed by a hash of their content (memory_service.composition_of).
+-- A snapshot references one plus the amount scale; portfolio_data is only set on rows saved before this.
+CREATE TABLE IF NOT EXISTS portfolio_compositions (
+    hash CHAR(64) PRIMARY KEY,
+    composition JSONB NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+ALTER TABLE user_portfolios ADD COLUMN IF NOT EXISTS composition_hash CHAR(64) REFERENCES portfolio_compositions(hash);
+ALTER TABLE user_portfolios ADD COLUMN IF NOT EXISTS amount_scale DOUBLE PRECISION;
+ALTER TABLE user_portfolios ALTER COLUMN portfolio_data DROP NOT NULL;
+
+-- Latest snapshot per user (/portfolio/latest, ORDER BY created_at DESC LIMIT 1)
+CREATE INDEX IF NOT EXISTS user_portfolios_user_created_idx ON user_portfolios (user_id, created_at DESC);
+
+-- Buy-and-hold valuation of saved portfolios (mark_to_market.py, nightly). Snapshots with the same
+-- composition saved on the same day share a row; value = amount invested * growth.
+CREATE TABLE IF NOT EXISTS portfolio_valuations (
+    composition_hash CHAR(64) NOT NULL REFERENCES portfolio_compositions(hash),
+    saved_on DATE NOT NULL,
+    as_of DATE NOT NULL,                     -- Latest NAV date used
+    growth DOUBLE PRECISION NOT NULL,        -- Current value / amount invested
+    max_drawdown DOUBLE PRECISION NOT NULL,  -- Worst peak-to-trough since saved_on, <= 0
+    priced_share DOUBLE PRECISION NOT NULL,  -- Share of the amount in funds with NAVs (the rest is held at cost)
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (composition_hash, saved_on)
+);
@@ -0,0 +1,233 @@
+# loadtest/replay.py
+# ---------------------------------------------------------------------------
+# Replay recorded traffic (traffic_recorder.py) against a test instance and
+# compare two builds.
+#
+#   # Re-issue at the original pace (--speed 2 = twice as fast, 0 = as fast as
+#   # --max-in-flight allows); results hold latency, status and a content
+#   # fingerprint (fund picks, chat reply, simulation result) per request
+#   python loadtest/replay.py run traffic/*.jsonl.gz --base-url http://old:8000 --out old.json
+#   python loadtest/replay.py run traffic/*.jsonl.gz --base-url http://new:8000 --out new.json
+#
+#   # Latency distributions side by side + requests whose content changed
+#   python loadtest/replay.py compare old.json new.json
+#
+# Recorded users are mapped onto the seeded load-test accounts
+# (loadtest/seed.py), the same pseudonym always to the same account.
+# ---------------------------------------------------------------------------
+import sys
+import glob
+import gzip
+import json
+import time
+import heapq
+import asyncio
+import argparse
+import httpx
+
+from throughput import get_token
+from run import summarize, git_revision
+
+
+def read_log(path):
+    """Records of one log file; a file cut off mid-write (killed worker) yields what is readable."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        try:
+            for line in f:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        return   # Partial last line
+        except EOFError:
+            return
+
+
+def load_records(patterns, endpoints=None, limit=None):
+    """All records from the given files/globs, merged by timestamp."""
+    paths = sorted({p for pattern in patterns for p in glob.glob(pattern)})
+    if not paths:
+        raise SystemExit(f"No traffic logs match {patterns}")
+    records = []
+    for rec in heapq.merge(*[read_log(p) for p in paths], key=lambda r: r["t"]):
+        if endpoints and rec["ep"] not in endpoints:
+            continue
+        records.append(rec)
+        if limit and len(records) >= limit:
+            break
+    return records
+
+
+def fingerprint(endpoint, data):
+    """The part of a response that should only change when behaviour changes."""
+    if endpoint == "/recommend":
+        return {
+            "picks": [[p.get("fund_id"), round(p.get("weight", 0), 4)] for p in data.get("portfolio", [])],
+            "allocation": {k: round(v, 4) for k, v in (data.get("allocation") or {}).items()},
+        }
+    if endpoint == "/chat/message":
+        return {"response": data.get("response"), "action": data.get("action")}
+    return data
+
+
+class Accounts:
+    """Recorded user pseudonym -> logged-in seeded account (lazily, one login per account)."""
+
+    def __init__(self, client, pattern, password, users):
+        self.client = client
+        self.pattern = pattern
+        self.password = password
+        self.users = users
+        self.assigned = {}
+        self.headers = {}
+
+    async def headers_for(self, pseudonym):
+        i = self.assigned.setdefault(pseudonym, len(self.assigned) % self.users)
+        if i not in self.headers:
+            token = await get_token(self.client, self.pattern.format(i=i), self.password)
+            self.headers[i] = {"Authorization": f"Bearer {token}"}
+        return self.headers[i]
+
+
+async def replay(args):
+    records = load_records(args.logs, endpoints=args.endpoint, limit=args.limit)
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    results = [None] * len(records)
+    in_flight = asyncio.Semaphore(args.max_in_flight)
+
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        accounts = Accounts(client, args.email_pattern, args.password, args.users)
+        for rec in records:   # Log in before the clock starts
+            await accounts.headers_for(rec["u"])
+
+        async def issue(i, rec, send_at):
+            delay = send_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with in_flight:
+                lag = time.perf_counter() - send_at
+                t0 = time.perf_counter()
+                try:
+                    r = await client.post(rec["ep"], json=rec["b"], headers=await accounts.headers_for(rec["u"]))
+                    status = r.status_code
+                    content = fingerprint(rec["ep"], r.json()) if status == 200 else None
+                except (httpx.HTTPError, ValueError) as e:
+                    status, content = type(e).__name__, None
+                results[i] = {"i": i, "t": rec["t"], "ep": rec["ep"], "status": status,
+                              "ms": round((time.perf_counter() - t0) * 1000, 2),
+                              "lag_ms": round(max(lag, 0) * 1000, 2), "content": content}
+
+        start = time.perf_counter()
+        t_first = records[0]["t"] if records else 0
+        await asyncio.gather(*[
+            issue(i, rec, start + ((rec["t"] - t_first) / args.speed if args.speed > 0 else 0))
+            for i, rec in enumerate(records)
+        ])
+        elapsed = time.perf_counter() - start
+
+    return {
+        "label": args.label,
+        "git_revision": git_revision(),
+        "base_url": args.base_url,
+        "logs": args.logs,
+        "speed": args.speed,
+        "recorded_span_s": round(records[-1]["t"] - t_first, 2) if records else 0,
+        "duration_s": round(elapsed, 2),
+        "summary": summarize_results(results, elapsed),
+        "requests": results,
+    }
+
+
+def summarize_results(results, elapsed):
+    by_ep = {}
+    for r in results:
+        s = by_ep.setdefault(r["ep"], {"latencies": [], "outcomes": {}})
+        s["outcomes"][r["status"]] = s["outcomes"].get(r["status"], 0) + 1
+        if r["status"] == 200:
+            s["latencies"].append(r["ms"] / 1000)
+    return {ep: summarize(s["latencies"], s["outcomes"], elapsed) for ep, s in sorted(by_ep.items())}
+
+
+def _keyed(requests):
+    """Recorded request identity -> result, so runs over different log sets still pair up."""
+    keyed, seen = {}, {}
+    for r in requests:
+        k = (r["t"], r["ep"])
+        seen[k] = seen.get(k, 0) + 1
+        keyed[k + (seen[k],)] = r
+    return keyed
+
+
+def compare(a, b, max_examples):
+    ka, kb = _keyed(a["requests"]), _keyed(b["requests"])
+    common = [k for k in ka if k in kb]
+    if len(common) != len(ka) or len(common) != len(kb):
+        print(f"warning: {len(ka)} vs {len(kb)} requests, comparing the {len(common)} replayed in both",
+              file=sys.stderr)
+    latency = {}
+    for ep in sorted(set(a["summary"]) | set(b["summary"])):
+        sa, sb = a["summary"].get(ep), b["summary"].get(ep)
+        latency[ep] = {"a": sa and sa["latency_ms"], "b": sb and sb["latency_ms"]}
+        if sa and sb and sa["latency_ms"]["p95"]:
+            latency[ep]["p95_change_pct"] = round(
+                (sb["latency_ms"]["p95"] - sa["latency_ms"]["p95"]) / sa["latency_ms"]["p95"] * 100, 1)
+
+    changed, status_changed, counts = [], [], {}
+    for k in common:
+        ra, rb = ka[k], kb[k]
+        c = counts.setdefault(ra["ep"], {"compared": 0, "content_changed": 0, "status_changed": 0})
+        c["compared"] += 1
+        if ra["status"] != rb["status"]:
+            c["status_changed"] += 1
+            status_changed.append({"i": ra["i"], "ep": ra["ep"], "a": ra["status"], "b": rb["status"]})
+        elif ra["content"] != rb["content"]:
+            c["content_changed"] += 1
+            changed.append({"i": ra["i"], "ep": ra["ep"], "a": ra["content"], "b": rb["content"]})
+
+    return {
+        "a": {"label": a["label"], "git_revision": a["git_revision"], "base_url": a["base_url"]},
+        "b": {"label": b["label"], "git_revision": b["git_revision"], "base_url": b["base_url"]},
+        "latency_ms": latency,
+        "changes": counts,
+        "status_changed_examples": status_changed[:max_examples],
+        "content_changed_examples": changed[:max_examples],
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    r = sub.add_parser("run", help="Replay traffic logs against one instance")
+    r.add_argument("logs", nargs="+", help="traffic-*.jsonl.gz files or globs")
+    r.add_argument("--base-url", default="http://localhost:8000")
+    r.add_argument("--speed", type=float, default=1.0, help="1 = recorded pace, 2 = twice as fast, 0 = no pacing")
+    r.add_argument("--max-in-flight", type=int, default=64)
+    r.add_argument("--endpoint", action="append", help="Only replay this endpoint (repeatable)")
+    r.add_argument("--limit", type=int, help="Replay at most this many requests")
+    r.add_argument("--users", type=int, default=200, help="Seeded accounts to map recorded users onto")
+    r.add_argument("--email-pattern", default="loadtest{i}@example.com")
+    r.add_argument("--password", default="loadtest")
+    r.add_argument("--timeout", type=float, default=30)
+    r.add_argument("--label", default="")
+    r.add_argument("--out", required=True, help="Results JSON (input to `compare`)")
+
+    c = sub.add_parser("compare", help="Compare two `run` results (a = baseline, b = candidate)")
+    c.add_argument("a")
+    c.add_argument("b")
+    c.add_argument("--examples", type=int, default=10, help="Changed requests to show")
+    args = ap.parse_args()
+
+    if args.command == "run":
+        result = asyncio.run(replay(args))
+        with open(args.out, "w") as f:
+            json.dump(result, f)
+        print(json.dumps({k: v for k, v in result.items() if k != "requests"}, indent=2))
+    else:
+        with open(args.a) as fa, open(args.b) as fb:
+            print(json.dumps(compare(json.load(fa), json.load(fb), args.examples), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# loadtest/run.py
+# ---------------------------------------------------------------------------
+# Mixed-endpoint load test. C closed-loop clients, each logged in as one of
+# the seeded users (loadtest/seed.py), pick operations by weight for D
+# seconds: /token, /recommend, /chat/message, /funds, /simulate,
+# /portfolio/latest and /portfolio/save. Per-operation latency percentiles,
+# throughput and status counts are written as JSON, so a release can be
+# compared against a stored baseline:
+#
+#   python loadtest/run.py -c 32 -d 60 --out baseline.json
+#   ... deploy the next build ...
+#   python loadtest/run.py -c 32 -d 60 --baseline baseline.json --max-regression 20
+#
+# Exits non-zero when a compared p95 or throughput regressed by more than
+# --max-regression percent. Start the API with MARKET_DATA_PROVIDER=memory so
+# market data never leaves the machine.
+# ---------------------------------------------------------------------------
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+from datetime import datetime, timezone
+import httpx
+import numpy as np
+
+from throughput import get_token
+
+DEFAULT_MIX = "recommend=30,portfolio_latest=25,funds=15,chat=10,simulate=10,portfolio_save=5,token=5"
+
+CHAT_MESSAGES = (
+    "Hello", "Why did you pick these funds?", "Compare the large cap options",
+    "What if the market crashes?", "Show me alternatives for my mid cap fund", "Where should I invest?",
+)
+SCENARIOS = ("2008_CRASH", "2020_COVID", "2022_RATES")
+FUND_CATEGORIES = ("Large Cap", "Mid Cap", "Small Cap", "Flexi Cap", "Liquid", "Gilt", "Gold")
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in OPERATIONS:
+            raise SystemExit(f"Unknown operation '{name}'. Choose from {sorted(OPERATIONS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+# --- Operations: (client, session, rng) -> httpx.Response ---
+
+def random_profile(rng):
+    return {
+        "amount": rng.choice((100000, 500000, 2500000)),
+        "horizon_years": rng.choice((3, 7, 15)),
+        "risk_tolerance": rng.choice(("Low", "Moderate", "High")),
+        "age": rng.randint(22, 65),
+    }
+
+
+async def op_token(client, session, rng):
+    return await client.post("/token", data={"username": session["email"], "password": session["password"]})
+
+
+async def op_recommend(client, session, rng):
+    r = await client.post("/recommend", json=random_profile(rng), headers=session["headers"])
+    if r.status_code == 200:
+        session["last_recommendation"] = r.json()
+    return r
+
+
+async def op_chat(client, session, rng):
+    return await client.post("/chat/message", json={"message": rng.choice(CHAT_MESSAGES)}, headers=session["headers"])
+
+
+async def op_funds(client, session, rng):
+    params = {"limit": rng.choice((20, 100)), "sort": rng.choice(("fund_id", "score"))}
+    if rng.random() < 0.5:
+        params["category"] = rng.choice(FUND_CATEGORIES)
+    return await client.get("/funds", params=params, headers=session["headers"])
+
+
+async def op_simulate(client, session, rng):
+    rec = session.get("last_recommendation") or session["seed_recommendation"]
+    return await client.post("/simulate", json={"portfolio": rec["portfolio"], "scenario_id": rng.choice(SCENARIOS)},
+                             headers=session["headers"])
+
+
+async def op_portfolio_latest(client, session, rng):
+    return await client.get("/portfolio/latest", headers=session["headers"])
+
+
+async def op_portfolio_save(client, session, rng):
+    rec = session.get("last_recommendation") or session["seed_recommendation"]
+    return await client.post("/portfolio/save", json=rec, headers=session["headers"])
+
+
+OPERATIONS = {
+    "token": op_token,
+    "recommend": op_recommend,
+    "chat": op_chat,
+    "funds": op_funds,
+    "simulate": op_simulate,
+    "portfolio_latest": op_portfolio_latest,
+    "portfolio_save": op_portfolio_save,
+}
+
+
+async def client_loop(client, session, mix, rng, deadline, results):
+    names, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        t0 = time.perf_counter()
+        try:
+            r = await OPERATIONS[name](client, session, rng)
+            outcome = r.status_code
+        except httpx.HTTPError as e:
+            outcome = type(e).__name__
+        res = results.setdefault(name, {"latencies": [], "outcomes": {}})
+        res["outcomes"][outcome] = res["outcomes"].get(outcome, 0) + 1
+        if outcome == 200 or outcome == 201:
+            res["latencies"].append(time.perf_counter() - t0)
+
+
+def summarize(latencies, outcomes, elapsed):
+    lat_ms = np.array(latencies) * 1000 if latencies else np.array([0.0])
+    return {
+        "requests": sum(outcomes.values()),
+        "ok": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {p: round(float(np.percentile(lat_ms, q)), 1)
+                       for p, q in (("p50", 50), ("p90", 90), ("p95", 95), ("p99", 99), ("max", 100))},
+        "status": {str(k): v for k, v in sorted(outcomes.items(), key=lambda kv: str(kv[0]))},
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    mix = parse_mix(args.mix)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        # Log every client in up front (not timed) and fetch one recommendation for /simulate and /portfolio/save
+        sessions = []
+        for i in range(args.concurrency):
+            email = args.email_pattern.format(i=i % args.users)
+            token = await get_token(client, email, args.password)
+            sessions.append({"email": email, "password": args.password,
+                             "headers": {"Authorization": f"Bearer {token}"}})
+        r = await client.post("/recommend", json=random_profile(random.Random(args.seed)), headers=sessions[0]["headers"])
+        r.raise_for_status()
+        for s in sessions:
+            s["seed_recommendation"] = r.json()
+
+        if args.warmup > 0:
+            await asyncio.gather(*[
+                client_loop(client, s, mix, random.Random(args.seed + i), time.perf_counter() + args.warmup, {})
+                for i, s in enumerate(sessions)
+            ])
+
+        results = {}
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*[
+            client_loop(client, s, mix, random.Random(args.seed + 1000 + i), deadline, results)
+            for i, s in enumerate(sessions)
+        ])
+        elapsed = time.perf_counter() - start
+
+    all_latencies = [x for r in results.values() for x in r["latencies"]]
+    all_outcomes = {}
+    for r in results.values():
+        for k, v in r["outcomes"].items():
+            all_outcomes[k] = all_outcomes.get(k, 0) + v
+    return {
+        "label": args.label,
+        "git_revision": git_revision(),
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {"base_url": args.base_url, "concurrency": args.concurrency, "duration_s": args.duration,
+                   "users": args.users, "mix": mix, "seed": args.seed},
+        "duration_s": round(elapsed, 2),
+        "total": summarize(all_latencies, all_outcomes, elapsed),
+        "operations": {name: summarize(r["latencies"], r["outcomes"], elapsed) for name, r in sorted(results.items())},
+    }
+
+
+def compare(report, baseline, max_regression):
+    """Percent change vs baseline per operation (p95 latency, throughput); list of regressions over the limit."""
+    changes, regressions = {}, []
+    for name in ["total"] + sorted(report["operations"]):
+        cur = report["total"] if name == "total" else report["operations"][name]
+        base = baseline["total"] if name == "total" else baseline.get("operations", {}).get(name)
+        if not base:
+            continue
+        pct = lambda a, b: round((a - b) / b * 100, 1) if b else None
+        p95 = pct(cur["latency_ms"]["p95"], base["latency_ms"]["p95"])
+        rps = pct(cur["throughput_rps"], base["throughput_rps"])
+        changes[name] = {"p95_pct": p95, "throughput_pct": rps}
+        if p95 is not None and p95 > max_regression:
+            regressions.append(f"{name}: p95 +{p95}%")
+        if rps is not None and -rps > max_regression:
+            regressions.append(f"{name}: throughput {rps}%")
+    return changes, regressions
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--base-url", default="http://localhost:8000")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="Weighted operations, e.g. recommend=30,funds=10")
+    ap.add_argument("-c", "--concurrency", type=int, default=32)
+    ap.add_argument("-d", "--duration", type=float, default=30)
+    ap.add_argument("--warmup", type=float, default=5, help="Seconds of untimed load first")
+    ap.add_argument("--users", type=int, default=200, help="Seeded users to spread clients over")
+    ap.add_argument("--email-pattern", default="loadtest{i}@example.com")
+    ap.add_argument("--password", default="loadtest")
+    ap.add_argument("--timeout", type=float, default=30)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--label", default="")
+    ap.add_argument("--out", help="Write the JSON report here (default: stdout only)")
+    ap.add_argument("--baseline", help="Earlier report to compare against")
+    ap.add_argument("--max-regression", type=float, default=20, help="Percent; exit 1 beyond this")
+    args = ap.parse_args()
+
+    report = asyncio.run(run(args))
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["vs_baseline"], regressions = compare(report, json.load(f), args.max_regression)
+        report["regressions"] = regressions
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# loadtest/throughput.py
+# ---------------------------------------------------------------------------
+# Closed-loop throughput check for a single endpoint: C concurrent clients
+# hammer one route for D seconds and we report req/s and latency percentiles.
+#
+# Used to compare the sync-route build against the async one:
+#   git checkout <before>; uvicorn main:app --workers 1 &
+#   python loadtest/throughput.py --endpoint /portfolio/latest -c 64 -d 30 --label sync
+#   git checkout <after>;  (restart uvicorn)
+#   python loadtest/throughput.py --endpoint /portfolio/latest -c 64 -d 30 --label async
+# ---------------------------------------------------------------------------
+import argparse
+import asyncio
+import json
+import time
+import httpx
+import numpy as np
+
+
+async def get_token(client, email, password):
+    r = await client.post("/token", data={"username": email, "password": password})
+    r.raise_for_status()
+    return r.json()["access_token"]
+
+
+async def worker(client, method, endpoint, body, headers, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        try:
+            r = await client.request(method, endpoint, json=body, headers=headers)
+            if r.status_code >= 400:
+                errors[r.status_code] = errors.get(r.status_code, 0) + 1
+            else:
+                latencies.append(time.perf_counter() - t0)
+        except httpx.HTTPError as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        token = await get_token(client, args.email, args.password)
+        headers = {"Authorization": f"Bearer {token}"}
+        body = json.loads(args.body) if args.body else None
+
+        latencies, errors = [], {}
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*[
+            worker(client, args.method, args.endpoint, body, headers, deadline, latencies, errors)
+            for _ in range(args.concurrency)
+        ])
+        elapsed = time.perf_counter() - start
+
+    lat_ms = np.array(latencies) * 1000 if latencies else np.array([0.0])
+    return {
+        "label": args.label,
+        "endpoint": args.endpoint,
+        "concurrency": args.concurrency,
+        "duration_s": round(elapsed, 2),
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {p: round(float(np.percentile(lat_ms, q)), 1)
+                       for p, q in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))},
+        "errors": errors,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--base-url", default="http://localhost:8000")
+    ap.add_argument("--endpoint", default="/portfolio/latest")
+    ap.add_argument("--method", default="GET")
+    ap.add_argument("--body", default=None, help="JSON request body")
+    ap.add_argument("--email", default="loadtest@example.com")
+    ap.add_argument("--password", default="loadtest")
+    ap.add_argument("-c", "--concurrency", type=int, default=32)
+    ap.add_argument("-d", "--duration", type=float, default=20)
+    ap.add_argument("--timeout", type=float, default=30)
+    ap.add_argument("--label", default="")
+    args = ap.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
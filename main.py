@@ -1,19 +1,41 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, status, BackgroundTasks, Request, Query, Header
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from starlette.routing import Match
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel, Field
 import uvicorn
 import os
 import json
+import time
+import asyncio
+import functools
+import anyio
 from typing import Optional, List, Dict, Any
 from sqlalchemy import text
 from datetime import timedelta
 
-from portfolio_service import generate_portfolio
-from score_service import load_latest_features, engine
+from portfolio_service import generate_portfolio, warm_up
+from portfolio_optimizer import OPTIMIZER_MODES
 from auth_service import (
-    Token, verify_password, get_password_hash, create_access_token, decode_token, ACCESS_TOKEN_EXPIRE_MINUTES
+    Token, hash_password_async, verify_password_async, shutdown_hash_pool, create_access_token, decode_claims,
+    is_admin_token, ACCESS_TOKEN_EXPIRE_MINUTES
 )
-from memory_service import save_portfolio_snapshot, log_interaction, get_user_risk_score, get_latest_portfolio
+from memory_service import (
+    save_portfolio_snapshot_async, get_latest_portfolio_async, get_user_context_async, get_user_risk_score_async,
+    record_recommendation_async, write_queue, invalidate_latest_portfolios, latest_cache_stats
+)
+from async_db import get_async_engine, dispose_async_engine
+from market_service import start_background_refresh, invalidate_market_status
+from snapshot_cache import cached_json, invalidate as invalidate_fund_bodies
+from score_service import invalidate_snapshot
+import change_feed
+import traffic_recorder
+from fast_json import FastJSONResponse
+import metrics
+import profiler
+from admission import admit, CONTROLLERS
+from metrics import HTTP_REQUEST_SECONDS, HTTP_IN_FLIGHT, DB_QUERY_SECONDS
+from fund_service import list_funds_page, stream_funds_ndjson, decode_cursor, FUND_SORTS, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -27,13 +49,129 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Readiness (distinct from liveness): set once warm-up has loaded the scored
+# snapshot, risk model and market status, so load balancers only route to warm workers.
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", 5))
+readiness = {"ready": False, "error": None, "timings": None}
+
+async def run_warm_up():
+    started = time.perf_counter()
+    while True:
+        try:
+            async with get_async_engine().connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            timings = await run_cpu(warm_up)
+            timings["total"] = round(time.perf_counter() - started, 3)
+            readiness.update(ready=True, error=None, timings=timings)
+            print(f"Warm-up complete: {timings}")
+            return
+        except Exception as e:
+            readiness["error"] = str(e)
+            print(f"Warm-up failed, retrying in {WARMUP_RETRY_SECONDS:.0f}s: {e}")
+            await asyncio.sleep(WARMUP_RETRY_SECONDS)
+
+# Batch jobs NOTIFY on commit (change_feed); drop whatever the change touched
+@change_feed.subscribe
+def on_data_changed(change):
+    kinds = change["kinds"] or (change_feed.FEATURES, change_feed.FUNDS, change_feed.MARKET, change_feed.PORTFOLIOS)
+    if change_feed.PORTFOLIOS in kinds:
+        invalidate_latest_portfolios(change.get("users"), source=change["source"])
+        if change["kinds"] == [change_feed.PORTFOLIOS]:
+            return   # Every portfolio save: not worth a log line
+    if change_feed.FEATURES in kinds or change_feed.FUNDS in kinds:
+        invalidate_fund_bodies()   # /funds pages and alternatives
+        # New features are published by the job itself; a funds change needs a re-score.
+        # After a reconnect (kinds None) just re-check rather than re-score in every worker.
+        invalidate_snapshot(force=change["kinds"] is not None and change_feed.FUNDS in kinds,
+                            changed_at=change["at"],
+                            version=change["version"] if change_feed.FEATURES in kinds else None)
+    if change_feed.MARKET in kinds:
+        invalidate_market_status()
+    print(f"Data changed ({change['source']}, version {change['version']}): invalidated {', '.join(kinds)}")
+
 @app.on_event("startup")
 async def startup_event():
+    # Keep market status warm so /recommend never waits on the market data provider
+    start_background_refresh()
+    # Warm up in the background: liveness answers immediately, /ready flips when done
+    app.state.warm_up_task = asyncio.create_task(run_warm_up())
+    if change_feed.CHANGE_FEED_ENABLED:
+        app.state.change_feed_task = asyncio.create_task(change_feed.listen_forever())
+
     print("--- REGISTERED ROUTES ---")
     for route in app.routes:
         print(f"{route.methods} {route.path}")
     print("-------------------------")
 
+def _route_template(scope):
+    """Path template (/funds/{fund_id}/alternatives) so metrics labels stay low-cardinality."""
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    labels = {"method": request.method, "route": _route_template(request.scope)}
+    HTTP_IN_FLIGHT.inc(**labels)
+    t0 = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        HTTP_IN_FLIGHT.dec(**labels)
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - t0, status=str(status_code), **labels)
+
+# Opt-in profiling: send `X-Profile: <ADMIN_TOKEN>` and the request's CPU work is sampled;
+# the profile id comes back in X-Profile-Id. Header only: query strings end up in access logs.
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    flag = request.headers.get("x-profile")
+    if not flag or not is_admin_token(flag):
+        return await call_next(request)
+
+    profile = profiler.Profile(f"{request.method} {request.url.path}").start()
+    token = profiler.current_profile.set(profile)
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.current_profile.reset(token)
+        await anyio.to_thread.run_sync(profile.stop)   # Joins the sampler thread: not on the event loop
+        profiler.save(profile)
+    response.headers["X-Profile-Id"] = profile.id
+    return response
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for name in ("warm_up_task", "change_feed_task"):
+        task = getattr(app.state, name, None)
+        if task is not None and not task.done():
+            task.cancel()
+    shutdown_hash_pool()
+    await write_queue.close()   # Flush buffered logs/snapshots before the engine goes away
+    await dispose_async_engine()
+
+# CPU-heavy work (portfolio generation, chat) runs on a bounded
+# thread pool so it never blocks the event loop and can't starve the I/O routes.
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", 4))
+_cpu_limiter = None
+
+async def run_cpu(fn, *args, **kwargs):
+    global _cpu_limiter
+    if _cpu_limiter is None:
+        _cpu_limiter = anyio.CapacityLimiter(CPU_WORKERS)
+    profile = profiler.current_profile.get()
+    if profile is not None:
+        fn = profile.wrap(fn)   # Sample the worker thread for a profiled request
+    return await anyio.to_thread.run_sync(functools.partial(fn, *args, **kwargs), limiter=_cpu_limiter)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 # --- DATA MODELS ---
@@ -50,6 +188,7 @@ class UserProfile(BaseModel):
     goal: Optional[str] = Field(None, description="Investment Goal e.g. Wealth, Retirement")
     age: Optional[int] = Field(None, description="User Age")
     current_investments: Optional[float] = Field(0.0, description="Existing Investments")
+    optimizer: Optional[str] = Field(None, description="Weighting mode: min_variance, risk_parity, max_sharpe (default: fixed slots)")
 
 class PortfolioItem(BaseModel):
     fund_id: str
@@ -71,51 +210,101 @@ class RecommendationResponse(BaseModel):
     market_status: Dict[str, Any]
     allocation: Dict[str, float]
     portfolio: List[PortfolioItem]
-    sections: Optional[Dict[str, List[PortfolioItem]]] = None
+    sections: Optional[Dict[str, List[int]]] = Field(None, description="Indices into `portfolio` per asset class")
     breakdown: Optional[RecommendationsBreakdown] = None
+    risk_metrics: Optional[Dict[str, float]] = None
     explanation: str
     confidence_score: Optional[float] = 80.0
     stability_label: Optional[str] = "High"
 
 # --- DEPENDENCIES ---
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
-    email = decode_token(token)
-    if email is None:
+def get_current_claims(token: str = Depends(oauth2_scheme)):
+    # Verified tokens are cached in auth_service, so this is normally a dict lookup
+    claims = decode_claims(token)
+    if claims is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return email
-
-# Helper to get user ID
-def get_user_id(email: str):
-    with engine.connect() as conn:
-        res = conn.execute(text("SELECT id FROM users WHERE email = :e"), {'e': email}).fetchone()
-        return res[0] if res else None
+    return claims
+
+def get_current_user(claims: Dict[str, Any] = Depends(get_current_claims)):
+    return claims["sub"]
+
+# Helper to get user ID: from the token, or one SELECT for tokens issued without "uid"
+async def get_user_id(claims: Dict[str, Any]):
+    if claims.get("uid"):
+        return claims["uid"]
+    with DB_QUERY_SECONDS.time(op='user_id'):
+        async with get_async_engine().connect() as conn:
+            res = (await conn.execute(text("SELECT id FROM users WHERE email = :e"), {'e': claims["sub"]})).fetchone()
+    return res[0] if res else None
+
+# --- HEALTH ---
+
+@app.get("/health")
+async def health():
+    """Liveness: the process is up and serving."""
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 once warm-up has finished, 503 until then."""
+    if not readiness["ready"]:
+        return JSONResponse(status_code=503, content={"status": "warming_up", "error": readiness["error"]})
+    return {
+        "status": "ready",
+        "warmup_seconds": readiness["timings"],
+        "admission": {cls: c.stats() for cls, c in CONTROLLERS.items()},
+        "change_feed": change_feed.stats(),
+        "traffic_recording": traffic_recorder.stats(),
+        "write_behind": write_queue.status(),
+        "latest_portfolio_cache": latest_cache_stats(),
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint (text format 0.0.4)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# --- ADMIN: REQUEST PROFILES ---
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    return profiler.list_profiles()
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    """Collapsed stacks (flamegraph.pl / speedscope / inferno input)."""
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile.collapsed())
 
 # --- AUTH ROUTES ---
 
 @app.post("/register", status_code=status.HTTP_201_CREATED)
-def register(user: UserRegister):
-    hashed_pw = get_password_hash(user.password)
+async def register(user: UserRegister):
+    async with admit("auth"):
+        hashed_pw = await hash_password_async(user.password)
     try:
-        with engine.begin() as conn:
+        async with get_async_engine().begin() as conn:
             # Check exist
-            exists = conn.execute(text("SELECT id FROM users WHERE email = :e"), {'e': user.email}).fetchone()
+            exists = (await conn.execute(text("SELECT id FROM users WHERE email = :e"), {'e': user.email})).fetchone()
             if exists:
                 raise HTTPException(status_code=400, detail="Email already registered")
             
             # Insert User
-            res = conn.execute(
+            res = await conn.execute(
                 text("INSERT INTO users (email, password_hash, phone_number) VALUES (:e, :p, :ph) RETURNING id"),
                 {'e': user.email, 'p': hashed_pw, 'ph': user.phone}
             )
             user_id = res.fetchone()[0]
             
             # Create Profile Placeholder
-            conn.execute(text("INSERT INTO user_profiles (user_id) VALUES (:uid)"), {'uid': user_id})
+            await conn.execute(text("INSERT INTO user_profiles (user_id) VALUES (:uid)"), {'uid': user_id})
             
     except Exception as e:
         if "Email already registered" in str(e): raise e
@@ -123,61 +312,87 @@ def register(user: UserRegister):
     return {"message": "User created successfully"}
 
 @app.post("/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     # 1. Fetch User from DB
     try:
-        with engine.connect() as conn:
-            user = conn.execute(text("SELECT email, password_hash FROM users WHERE email = :e"), {'e': form_data.username}).fetchone()
+        with DB_QUERY_SECONDS.time(op='login_lookup'):
+            async with get_async_engine().connect() as conn:
+                user = (await conn.execute(text("""
+                    SELECT u.id, u.email, u.password_hash,
+                           COALESCE((SELECT EXTRACT(EPOCH FROM MAX(p.updated_at))::BIGINT
+                                     FROM user_profiles p WHERE p.user_id = u.id), 0) AS profile_version
+                    FROM users u WHERE u.email = :e
+                """), {'e': form_data.username})).fetchone()
     except Exception as e:
          raise HTTPException(status_code=500, detail="Database error")
 
     # 2. Authenticate
-    if not user or not verify_password(form_data.password, user.password_hash):
+    if user:
+        async with admit("auth"):
+            verified, new_hash = await verify_password_async(form_data.password, user.password_hash)
+    if not user or not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        # Stored hash uses an old cost (PASSWORD_HASH_ROUNDS changed): upgrade it now we know the password
+        try:
+            async with get_async_engine().begin() as conn:
+                await conn.execute(text("UPDATE users SET password_hash = :h WHERE id = :id"),
+                                   {'h': new_hash, 'id': user.id})
+        except Exception as e:
+            print(f"Error rehashing password for user {user.id}: {e}")
     
-    # 3. Create Token
+    # 3. Create Token (user id + profile version as claims: no identity lookups per request)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": user.email, "uid": user.id, "pv": int(user.profile_version)}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 # --- APP ROUTES ---
 
-@app.post("/recommend", response_model=RecommendationResponse)
-def get_recommendation(profile: UserProfile, current_user_email: str = Depends(get_current_user)):
+# response_model documents the shape; the body is trusted internal output, so it is
+# returned as a FastJSONResponse and skips re-validation through the Pydantic models.
+@app.post("/recommend", response_model=RecommendationResponse, response_class=FastJSONResponse)
+async def get_recommendation(profile: UserProfile, background_tasks: BackgroundTasks,
+                             claims: Dict[str, Any] = Depends(get_current_claims)):
+    if profile.optimizer and profile.optimizer not in OPTIMIZER_MODES:
+        raise HTTPException(status_code=422, detail=f"optimizer must be one of {list(OPTIMIZER_MODES)}")
     try:
         # Convert pydantic model to dict
         user_dict = profile.model_dump()
         
-        # PERSISTENCE READ (Memory Layer)
-        user_id = get_user_id(current_user_email)
+        # PERSISTENCE READ (Memory Layer): historical risk score (user id comes from the token)
+        user_id = claims.get("uid")
         if user_id:
-            # Inject historical risk score if exists
-            hist_score = get_user_risk_score(user_id)
-            if hist_score is not None:
-                user_dict['historic_risk_score'] = float(hist_score)
-
-        # Generator Portfolio
-        result = generate_portfolio(user_dict)
+            hist_score = await get_user_risk_score_async(user_id, claims.get("pv"))
+        else:
+            user_id, hist_score = await get_user_context_async(claims["sub"])
+        traffic_recorder.record("/recommend", user_dict, user_id)
+        if user_id and hist_score is not None:
+            user_dict['historic_risk_score'] = float(hist_score)
+
+        # Generator Portfolio (CPU-bound: off the event loop, 503 when saturated)
+        async with admit("portfolio"):
+            result = await run_cpu(generate_portfolio, user_dict)
         
-        # PERSISTENCE WRITE (Memory Layer)
+        # PERSISTENCE WRITE (Memory Layer): snapshot + interaction log queued after the response is sent,
+        # written in batches shared with other requests (memory_service.write_queue)
         if user_id:
-            # Save Snapshot
-            save_portfolio_snapshot(
+            background_tasks.add_task(
+                record_recommendation_async,
                 user_id, 
                 result['portfolio'], 
                 result['allocation'], 
                 result.get('market_status', {}).get('phase', 'UNKNOWN')
             )
-            # Log Interaction
-            log_interaction(user_id, 'generate_portfolio', details=result['allocation'])
             
-        return result
+        return FastJSONResponse(result)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -190,14 +405,15 @@ class ChatRequest(BaseModel):
     user_id: Optional[int] = None
 
 @app.post("/chat/message")
-def chat_endpoint(request: ChatRequest, current_user_email: Optional[str] = Depends(get_current_user)):
-    user_id = None
-    if current_user_email:
-        user_id = get_user_id(current_user_email)
+async def chat_endpoint(request: ChatRequest, claims: Dict[str, Any] = Depends(get_current_claims)):
+    user_id = await get_user_id(claims)
+    traffic_recorder.record("/chat/message", request.model_dump(), user_id)
     
     # Logic to fetch profile if needed
     # For now, pass basic context
-    response = handle_chat_message(user_id, request.message, context=request.context)
+    # ALTERNATIVES intent scores the universe, so treat chat as CPU work
+    async with admit("chat"):
+        response = await run_cpu(handle_chat_message, user_id, request.message, context=request.context)
     return response
 
 from simulation_engine import run_simulation
@@ -207,78 +423,112 @@ class SimulationRequest(BaseModel):
     scenario_id: str
 
 @app.post("/simulate")
-def simulate_endpoint(req: SimulationRequest):
+async def simulate_endpoint(req: SimulationRequest):
     # Convert Pydantic list to dict list
     port_list = [p.dict() for p in req.portfolio]
+    traffic_recorder.record("/simulate", {"portfolio": port_list, "scenario_id": req.scenario_id})
     return run_simulation(port_list, req.scenario_id)
 
+# Fund endpoints only change with the fund snapshot: bodies are cached per
+# snapshot version and revalidated with ETag / If-None-Match (see snapshot_cache).
+
 @app.get("/funds")
-def list_funds(current_user: str = Depends(get_current_user)):
+async def list_funds(
+    request: Request,
+    category: Optional[str] = None,
+    min_aum: Optional[float] = Query(None, ge=0, description="Minimum AUM (Cr)"),
+    max_aum: Optional[float] = Query(None, ge=0, description="Maximum AUM (Cr)"),
+    tier: Optional[int] = Query(None, ge=1, le=3, description="1 = Elite, 2 = Strong, 3 = Rest"),
+    min_score: Optional[float] = Query(None, ge=0, le=100),
+    max_score: Optional[float] = Query(None, ge=0, le=100),
+    sort: str = Query("fund_id", description="fund_id or score (descending)"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    format: str = Query("json", description="json (paged) or ndjson (full export, streamed)"),
+    current_user: str = Depends(get_current_user),
+):
+    if sort not in FUND_SORTS:
+        raise HTTPException(status_code=422, detail=f"sort must be one of {list(FUND_SORTS)}")
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=422, detail="format must be json or ndjson")
+    if cursor:
+        try:
+            decode_cursor(cursor, sort)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+    filters = {"category": category, "min_aum": min_aum, "max_aum": max_aum,
+               "tier": tier, "min_score": min_score, "max_score": max_score}
+
+    if format == "ndjson":
+        return StreamingResponse(stream_funds_ndjson(filters, sort), media_type="application/x-ndjson")
+
+    key = ("funds", sort, cursor, limit, tuple(sorted(filters.items())))
     try:
-        with engine.connect() as conn:
-            # Simple query to list funds
-            res = conn.execute(text("SELECT fund_id, fund_name, category FROM funds LIMIT 100"))
-            funds = [dict(row._mapping) for row in res]
-            return funds
+        return await cached_json(request, key, lambda: list_funds_page(filters, sort, cursor, limit))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/funds/{fund_id}/alternatives")
-def get_alternatives(fund_id: str, current_user: str = Depends(get_current_user)):
+async def get_alternatives(fund_id: str, request: Request, current_user: str = Depends(get_current_user)):
     try:
-        with engine.connect() as conn:
-            # 1. Get category of target fund
-            target = conn.execute(
-                text("SELECT category, fund_name FROM funds WHERE fund_id = :fid"), 
-                {'fid': fund_id}
-            ).fetchone()
-            
-            if not target:
-                raise HTTPException(status_code=404, detail="Fund not found")
-            
-            category = target[0]
-            
-            # 2. Find others in same category
-            # Join with fund_features to get metrics
-            res = conn.execute(
-                text("""
-                    SELECT f.fund_id, f.fund_name, f.category, 
-                           COALESCE(ff.ann_return, 0) as ret, 
-                           COALESCE(ff.ann_vol, 0) as vol
-                    FROM funds f
-                    JOIN fund_features ff ON f.fund_id = ff.fund_id
-                    WHERE f.category = :cat 
-                      AND f.fund_id != :fid
-                      AND ff.as_of_date = (SELECT MAX(as_of_date) FROM fund_features)
-                    ORDER BY ff.ann_return DESC
-                    LIMIT 3
-                """), 
-                {'cat': category, 'fid': fund_id}
-            )
-            
-            alts = []
-            for row in res:
-                # Convert decimals/floats to python native types for JSON
-                r_val = float(row[3]) if row[3] is not None else 0.0
-                v_val = float(row[4]) if row[4] is not None else 0.0
-                
-                alts.append({
-                    "fund_id": row[0],
-                    "fund_name": row[1],
-                    "category": row[2],
-                    "metrics": {"returns": round(r_val, 2), "volatility": round(v_val, 2)}
-                })
-            
-            return {"original": target[1], "alternatives": alts}
-            
+        return await cached_json(request, ("alternatives", fund_id), lambda: _alternatives(fund_id))
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Alt Error: {e}")
         # Return the specific error message for debugging
         raise HTTPException(status_code=500, detail=f"Alt Error: {str(e)}")
 
+async def _alternatives(fund_id: str):
+    async with get_async_engine().connect() as conn:
+        # 1. Get category of target fund
+        target = (await conn.execute(
+            text("SELECT category, fund_name FROM funds WHERE fund_id = :fid"), 
+            {'fid': fund_id}
+        )).fetchone()
+        
+        if not target:
+            raise HTTPException(status_code=404, detail="Fund not found")
+        
+        category = target[0]
+        
+        # 2. Find others in same category
+        # Join with fund_features to get metrics
+        res = await conn.execute(
+            text("""
+                SELECT f.fund_id, f.fund_name, f.category, 
+                       COALESCE(ff.ann_return, 0) as ret, 
+                       COALESCE(ff.ann_vol, 0) as vol
+                FROM funds f
+                JOIN fund_features ff ON f.fund_id = ff.fund_id
+                WHERE f.category = :cat 
+                  AND f.fund_id != :fid
+                  AND ff.as_of_date = (SELECT MAX(as_of_date) FROM fund_features)
+                ORDER BY ff.ann_return DESC
+                LIMIT 3
+            """), 
+            {'cat': category, 'fid': fund_id}
+        )
+        
+        alts = []
+        for row in res:
+            # Convert decimals/floats to python native types for JSON
+            r_val = float(row[3]) if row[3] is not None else 0.0
+            v_val = float(row[4]) if row[4] is not None else 0.0
+            
+            alts.append({
+                "fund_id": row[0],
+                "fund_name": row[1],
+                "category": row[2],
+                "metrics": {"returns": round(r_val, 2), "volatility": round(v_val, 2)}
+            })
+        
+        return {"original": target[1], "alternatives": alts}
+
 @app.post("/portfolio/save")
-def save_portfolio(data: Dict[str, Any], current_user: str = Depends(get_current_user)):
-    user_id = get_user_id(current_user)
+async def save_portfolio(data: Dict[str, Any], claims: Dict[str, Any] = Depends(get_current_claims)):
+    user_id = await get_user_id(claims)
     if not user_id:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -293,7 +543,7 @@ def save_portfolio(data: Dict[str, Any], current_user: str = Depends(get_current
         raise HTTPException(status_code=422, detail="Portfolio must be a list")
 
     try:
-        pid = save_portfolio_snapshot(
+        pid = await save_portfolio_snapshot_async(
             user_id=user_id,
             portfolio_data=portfolio,
             allocation=allocation,
@@ -305,12 +555,12 @@ def save_portfolio(data: Dict[str, Any], current_user: str = Depends(get_current
         raise HTTPException(status_code=500, detail="Could not save portfolio")
 
 @app.get("/portfolio/latest")
-def get_latest(current_user: str = Depends(get_current_user)):
-    user_id = get_user_id(current_user)
+async def get_latest(claims: Dict[str, Any] = Depends(get_current_claims)):
+    user_id = await get_user_id(claims)
     if not user_id:
         raise HTTPException(status_code=404, detail="User not found")
         
-    p = get_latest_portfolio(user_id)
+    p = await get_latest_portfolio_async(user_id)
     if not p:
         return {"portfolio": None}
     return p
@@ -0,0 +1,213 @@
+# market_data.py
+# ---------------------------------------------------------------------------
+# Market data providers for index closes.
+#
+#   yfinance - live Yahoo Finance data (default)
+#   file     - CSV/Parquet files in MARKET_DATA_DIR, one per symbol
+#              (e.g. NSEI.csv with columns date,close) for offline runs / CI
+#   memory   - deterministic synthetic series that produce MARKET_DATA_PHASE
+#              (OVERHEATED / NEUTRAL / UNDERVALUED) for load tests & benchmarks
+#
+# Selected by MARKET_DATA_PROVIDER. Every provider is wrapped in a circuit
+# breaker so a failing upstream is skipped for a cool-down period instead of
+# costing a timeout on every refresh.
+# ---------------------------------------------------------------------------
+import os
+import re
+import math
+import time
+import threading
+import pandas as pd
+from pathlib import Path
+from datetime import date, timedelta
+
+MARKET_DATA_PROVIDER = os.getenv("MARKET_DATA_PROVIDER", "yfinance")
+MARKET_DATA_DIR = Path(os.getenv("MARKET_DATA_DIR", Path(__file__).parent / "market_data"))
+MARKET_DATA_PHASE = os.getenv("MARKET_DATA_PHASE", "NEUTRAL")
+MARKET_FETCH_TIMEOUT_SECONDS = float(os.getenv("MARKET_FETCH_TIMEOUT_SECONDS", 10))
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("MARKET_BREAKER_FAILURES", 3))   # Consecutive failures to open
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("MARKET_BREAKER_COOLDOWN", 300))  # Open for 5 min
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class MarketDataProvider:
+    name = "base"
+
+    def fetch_closes(self, symbol, start):
+        """Daily closes for `symbol` from `start` (inclusive) as [(date, close)], oldest first."""
+        raise NotImplementedError
+
+
+class YFinanceProvider(MarketDataProvider):
+    name = "yfinance"
+
+    def __init__(self, timeout=MARKET_FETCH_TIMEOUT_SECONDS):
+        self.timeout = timeout
+
+    def fetch_closes(self, symbol, start):
+        import yfinance as yf
+        hist = yf.Ticker(symbol).history(start=start, timeout=self.timeout)
+        if hist.empty:
+            return []
+        return [(ts.date(), float(c)) for ts, c in hist['Close'].dropna().items()]
+
+
+class FileProvider(MarketDataProvider):
+    """
+    One file per symbol in `data_dir`: <symbol>.parquet or <symbol>.csv with
+    'date' and 'close' columns. Symbol characters like '^' are stripped from
+    file names (^NSEI -> NSEI.csv). Files are re-read only when they change.
+    """
+    name = "file"
+
+    def __init__(self, data_dir=MARKET_DATA_DIR):
+        self.data_dir = Path(data_dir)
+        self._cache = {}  # path -> (mtime, DataFrame)
+
+    def _path(self, symbol):
+        stem = re.sub(r'[^A-Za-z0-9_.-]', '', symbol)
+        for ext in ('.parquet', '.csv'):
+            p = self.data_dir / f"{stem}{ext}"
+            if p.exists():
+                return p
+        raise FileNotFoundError(f"No market data file for {symbol} in {self.data_dir}")
+
+    def _load(self, path):
+        mtime = path.stat().st_mtime
+        cached = self._cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        df = pd.read_parquet(path) if path.suffix == '.parquet' else pd.read_csv(path)
+        df.columns = [c.lower() for c in df.columns]
+        df['date'] = pd.to_datetime(df['date']).dt.date
+        df = df.dropna(subset=['close']).sort_values('date')
+        self._cache[path] = (mtime, df)
+        return df
+
+    def fetch_closes(self, symbol, start):
+        df = self._load(self._path(symbol))
+        df = df[df['date'] >= start]
+        return list(zip(df['date'], df['close'].astype(float)))
+
+
+class InMemoryProvider(MarketDataProvider):
+    """
+    Closes held in memory: {symbol: [(date, close), ...]}.
+    `synthetic(phase)` builds series ending today whose SMA-200 deviation lands
+    firmly in the requested phase, so offline runs are deterministic.
+    """
+    name = "memory"
+
+    # Log-growth over the last 400 business days -> deviation from SMA-200
+    PHASE_GROWTH = {'OVERHEATED': 0.8, 'NEUTRAL': 0.0, 'UNDERVALUED': -0.6}   # ~ +21%, 0%, -14%
+
+    def __init__(self, series=None):
+        self.series = {s: sorted(v) for s, v in (series or {}).items()}
+
+    @classmethod
+    def synthetic(cls, phase=MARKET_DATA_PHASE, symbols=None, days=400, end=None):
+        from index_store import MARKET_INDICES
+        growth = cls.PHASE_GROWTH.get(str(phase).upper(), 0.0)
+        end = end or date.today()
+        dates = [d.date() for d in pd.bdate_range(end=end, periods=days)]
+        series = {}
+        for k, symbol in enumerate(symbols or MARKET_INDICES.values()):
+            base = 1000.0 * (k + 1)
+            series[symbol] = [
+                (d, base * math.exp(growth * i / days) * (1 + 0.008 * math.sin(i * 1.3 + k)))
+                for i, d in enumerate(dates)
+            ]
+        return cls(series)
+
+    def fetch_closes(self, symbol, start):
+        return [(d, c) for d, c in self.series.get(symbol, []) if d >= start]
+
+
+class CircuitBreaker(MarketDataProvider):
+    """
+    closed -> (N consecutive failures) -> open: calls fail fast with CircuitOpenError
+    open -> (cool-down elapsed) -> half-open: one trial call; success closes, failure re-opens.
+    """
+    def __init__(self, provider, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN_SECONDS):
+        self.provider = provider
+        self.name = provider.name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def fetch_closes(self, symbol, start):
+        with self.lock:
+            if self.opened_at is not None:
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    raise CircuitOpenError(f"{self.name} provider circuit open, skipping {symbol}")
+                self.opened_at = time.monotonic()  # half-open: let this call through, hold off the rest
+
+        try:
+            result = self.provider.fetch_closes(symbol, start)
+        except Exception:
+            with self.lock:
+                self.failures += 1
+                if self.failures >= self.failure_threshold or self.opened_at is not None:
+                    self.opened_at = time.monotonic()
+                    print(f"Market data circuit opened for {self.name} after {self.failures} failures "
+                          f"(cool-down {self.cooldown:.0f}s)")
+            raise
+
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+        return result
+
+
+def make_provider(kind=MARKET_DATA_PROVIDER):
+    kind = (kind or "yfinance").lower()
+    if kind == "yfinance":
+        provider = YFinanceProvider()
+    elif kind == "file":
+        provider = FileProvider()
+    elif kind == "memory":
+        provider = InMemoryProvider.synthetic()
+    else:
+        raise ValueError(f"Unknown MARKET_DATA_PROVIDER: {kind}")
+    return CircuitBreaker(provider)
+
+
+_provider = None
+
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        _provider = make_provider()
+    return _provider
+
+
+def set_provider(provider):
+    """Swap the active provider (tests, load tests, benchmarks)."""
+    global _provider
+    _provider = provider if isinstance(provider, CircuitBreaker) else CircuitBreaker(provider)
+
+
+if __name__ == "__main__":
+    # Write deterministic synthetic CSVs for the file provider:
+    #   python market_data.py [PHASE]  -> MARKET_DATA_DIR/<symbol>.csv
+    import sys
+    phase = sys.argv[1] if len(sys.argv) > 1 else MARKET_DATA_PHASE
+    MARKET_DATA_DIR.mkdir(parents=True, exist_ok=True)
+    for symbol, closes in InMemoryProvider.synthetic(phase).series.items():
+        path = MARKET_DATA_DIR / f"{re.sub(r'[^A-Za-z0-9_.-]', '', symbol)}.csv"
+        pd.DataFrame(closes, columns=['date', 'close']).to_csv(path, index=False)
+        print(f"Wrote {len(closes)} {phase} closes to {path}")
@@ -1,68 +1,260 @@
-import yfinance as yf
-import pandas as pd
+import os
+import json
+import time
+import threading
+from pathlib import Path
 from datetime import datetime, timedelta
+from index_store import IndexHistoryStore, MARKET_INDICES
+from market_data import get_provider, MARKET_FETCH_TIMEOUT_SECONDS
+from metrics import CACHE_REQUESTS
 
-MARKET_INDEX_SYMBOL = "^NSEI" # Nifty 50
+MARKET_INDEX_SYMBOL = MARKET_INDICES['NIFTY50'] # Nifty 50
 
-def get_market_status():
+# --- CACHE CONFIGURATION ---
+MARKET_STATUS_TTL_SECONDS = int(os.getenv("MARKET_STATUS_TTL_SECONDS", 900))       # Fresh for 15 min
+# A refresh syncs every index one after the other, each fetch bounded by MARKET_FETCH_TIMEOUT_SECONDS
+MARKET_REFRESH_TIMEOUT_SECONDS = MARKET_FETCH_TIMEOUT_SECONDS * len(MARKET_INDICES)
+
+CACHE_DIR = Path(os.getenv("MF_CACHE_DIR", Path(__file__).parent / "cache"))
+LAST_GOOD_FILE = CACHE_DIR / "market_status.json"  # Last-known-good, survives restarts
+
+NEUTRAL_STATUS = {"phase": "NEUTRAL", "details": "Market data unavailable, assuming Neutral."}
+
+_cache = {"status": None, "fetched_at": 0.0}
+_lock = threading.Lock()
+_refreshing = threading.Lock()   # Single-flight: held by the one upstream refresh allowed at a time
+_first_refresh = threading.Event()   # Set once the first refresh attempt has finished (either way)
+_refresher = None
+_index_store = None
+
+
+def get_index_store():
+    global _index_store
+    if _index_store is None:
+        from score_service import engine
+        _index_store = IndexHistoryStore(engine)
+    return _index_store
+
+
+def fetch_closes(symbol, start):
+    """Daily closes for `symbol` from `start` onwards as [(date, close)] (MARKET_DATA_PROVIDER)."""
+    return get_provider().fetch_closes(symbol, start)
+
+
+def compute_market_status():
     """
-    Analyzes the market phase based on Nifty 50 Trends.
-    Returns: dict with 'phase' (OVERHEATED, NEUTRAL, UNDERVALUED) and 'details'.
+    Analyzes the market phase based on Nifty 50 Trends (Nifty Midcap as breadth check).
+    Only closes newer than the local index history are fetched; indicators are
+    maintained incrementally by the store.
+    Returns: dict with 'phase' (OVERHEATED, NEUTRAL, UNDERVALUED) and 'details',
+    or None if there is no Nifty history at all.
     """
-    try:
-        # Fetch last 1 year data
-        ticker = yf.Ticker(MARKET_INDEX_SYMBOL)
-        hist = ticker.history(period="1y")
-        
-        if hist.empty:
-            return {"phase": "NEUTRAL", "details": "Market data unavailable, assuming Neutral."}
-            
-        current_price = hist['Close'].iloc[-1]
-        
-        # Calculate Daily Returns
-        hist['returns'] = hist['Close'].pct_change()
-        
-        # Calculate Volatility (30-day annualized)
-        current_vol = hist['returns'].tail(30).std() * (252 ** 0.5) * 100
-        
-        # Regime Detection
-        regime = "Normal"
-        if current_vol > 20: regime = "Volatile"
-        elif current_vol < 10: regime = "Stable"
-        
-        # Simple Logic for Phase
-        sma_200 = hist['Close'].rolling(window=200).mean().iloc[-1]
-        
-        # If not enough data for 200 SMA, fallback
-        if pd.isna(sma_200):
-             sma_200 = hist['Close'].mean() # Fallback to average of available history
-        
-        deviation_200 = (current_price - sma_200) / sma_200
-        
-        phase = "NEUTRAL"
-        phase_label = "Neutral"
-        
-        if deviation_200 > 0.15:
-            phase = "OVERHEATED"
-            phase_label = "Overheated"
-        elif deviation_200 < -0.10:
-            phase = "UNDERVALUED"
-            phase_label = "Undervalued"
-            
-        details = f"{regime} {phase_label} Market. Nifty @ {int(current_price)}. Volatility: {int(current_vol)}%."
-        
-        return {
-            "phase": phase,
-            "regime": regime,
-            "volatility": round(current_vol, 1),
-            "current_price": current_price,
-            "sma_200": sma_200 if not pd.isna(sma_200) else current_price,
-            "details": details
+    store = get_index_store()
+    store.sync(fetch_closes)
+    benchmarks = store.indicators()
+
+    nifty = benchmarks.get('NIFTY50')
+    if not nifty:
+        return None
+
+    current_price = nifty['current_price']
+    current_vol = nifty['volatility'] or 0.0
+    sma_200 = nifty['sma_200']
+    deviation_200 = nifty['deviation_200']
+
+    # Regime Detection
+    regime = "Normal"
+    if current_vol > 20: regime = "Volatile"
+    elif current_vol < 10: regime = "Stable"
+
+    phase = "NEUTRAL"
+    phase_label = "Neutral"
+
+    if deviation_200 > 0.15:
+        phase = "OVERHEATED"
+        phase_label = "Overheated"
+    elif deviation_200 < -0.10:
+        phase = "UNDERVALUED"
+        phase_label = "Undervalued"
+
+    # Breadth check: froth (or capitulation) in midcaps while Nifty is merely leaning that way
+    midcap_dev = (benchmarks.get('NIFTY_MIDCAP') or {}).get('deviation_200')
+    if phase == "NEUTRAL" and midcap_dev is not None:
+        if midcap_dev > 0.25 and deviation_200 > 0.05:
+            phase, phase_label = "OVERHEATED", "Overheated (Midcap-led)"
+        elif midcap_dev < -0.15 and deviation_200 < 0:
+            phase, phase_label = "UNDERVALUED", "Undervalued (Midcap-led)"
+
+    details = f"{regime} {phase_label} Market. Nifty @ {int(current_price)}. Volatility: {int(current_vol)}%."
+
+    return {
+        "phase": phase,
+        "regime": regime,
+        "volatility": round(float(current_vol), 1),
+        "current_price": float(current_price),
+        "sma_200": float(sma_200),
+        "details": details,
+        "source": get_provider().name,
+        "benchmarks": {
+            key: {k: (round(v, 4) if isinstance(v, float) else v) for k, v in b.items()}
+            for key, b in benchmarks.items()
         }
-        
+    }
+
+
+def _store(status, fetched_at):
+    with _lock:
+        _cache["status"] = status
+        _cache["fetched_at"] = fetched_at
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = LAST_GOOD_FILE.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"status": status, "fetched_at": fetched_at}))
+        os.replace(tmp, LAST_GOOD_FILE)
+    except Exception as e:
+        print(f"Error persisting market status: {e}")
+
+
+def _load_last_good():
+    try:
+        data = json.loads(LAST_GOOD_FILE.read_text())
+        return data["status"], float(data["fetched_at"])
+    except Exception:
+        return None, 0.0
+
+
+def refresh_market_status():
+    """
+    Fetch from upstream (bounded by MARKET_REFRESH_TIMEOUT_SECONDS) and update the cache.
+    Keeps the previous value on failure. Returns True if the cache was refreshed.
+    """
+    try:
+        return _refresh()
+    finally:
+        _first_refresh.set()
+
+
+def _run_with_timeout(fn, timeout):
+    """
+    fn() in a thread of its own, raising TimeoutError after `timeout` seconds.
+    A call still running then is abandoned (daemon thread) rather than queued
+    behind, so a hung fetch can't hold up later refreshes.
+    """
+    result = {}
+
+    def run():
+        try:
+            result["value"] = fn()
+        except BaseException as e:
+            result["error"] = e
+
+    worker = threading.Thread(target=run, name="market-fetch", daemon=True)
+    worker.start()
+    worker.join(timeout)
+    if worker.is_alive():
+        raise TimeoutError
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+def _refresh():
+    try:
+        status = _run_with_timeout(compute_market_status, MARKET_REFRESH_TIMEOUT_SECONDS)
+    except TimeoutError:
+        print(f"Market data fetch timed out after {MARKET_REFRESH_TIMEOUT_SECONDS}s, keeping last known status.")
+        return False
     except Exception as e:
         print(f"Error fetching market data: {e}")
-        return {"phase": "NEUTRAL", "details": "Error analyzing market, defaulted to Neutral."}
+        return False
+
+    if status is None:
+        print("Market data empty, keeping last known status.")
+        return False
+    _store(status, time.time())
+    return True
+
+
+def wait_for_first_refresh(timeout=None):
+    """Block until the first refresh attempt has finished; False on timeout."""
+    return _first_refresh.wait(timeout)
+
+
+def _refresh_in_background():
+    if not _refreshing.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            refresh_market_status()
+        finally:
+            _refreshing.release()
+
+    threading.Thread(target=run, name="market-refresh-once", daemon=True).start()
+
+
+def invalidate_market_status():
+    """Index history changed in the DB (etl_fetch_index): reload it and recompute in the background."""
+    get_index_store().loaded = False
+    _refresh_in_background()
+
+
+def get_market_status():
+    """
+    Cached market status. Never waits on the upstream provider:
+    fresh cache -> served; stale cache -> served while a refresh runs in the
+    background; nothing cached -> last-known-good from disk, else Neutral.
+    """
+    with _lock:
+        status, fetched_at = _cache["status"], _cache["fetched_at"]
+
+    if status is None:
+        status, fetched_at = _load_last_good()
+        if status is not None:
+            with _lock:
+                if _cache["status"] is None:
+                    _cache["status"], _cache["fetched_at"] = status, fetched_at
+
+    age = time.time() - fetched_at
+    if status is None or age > MARKET_STATUS_TTL_SECONDS:
+        _refresh_in_background()
+
+    if status is None:
+        CACHE_REQUESTS.inc(cache='market_status', result='miss')
+        return dict(NEUTRAL_STATUS)
+    CACHE_REQUESTS.inc(cache='market_status', result='stale' if age > MARKET_STATUS_TTL_SECONDS else 'hit')
+
+    result = dict(status)
+    result["as_of"] = datetime.fromtimestamp(fetched_at).isoformat(timespec="seconds")
+    result["stale"] = age > MARKET_STATUS_TTL_SECONDS
+    return result
+
+
+def start_background_refresh(interval=None):
+    """
+    Keep the cache warm: refresh every `interval` seconds (default half the TTL,
+    so requests normally never see a stale entry) in a daemon thread.
+    Safe to call more than once.
+    """
+    global _refresher
+    if _refresher is not None and _refresher.is_alive():
+        return _refresher
+    interval = interval or max(1, MARKET_STATUS_TTL_SECONDS // 2)
+
+    def loop():
+        while True:
+            if _refreshing.acquire(blocking=False):
+                try:
+                    refresh_market_status()
+                finally:
+                    _refreshing.release()
+            time.sleep(interval)
+
+    _refresher = threading.Thread(target=loop, name="market-refresher", daemon=True)
+    _refresher.start()
+    return _refresher
+
 
 if __name__ == "__main__":
+    refresh_market_status()
     print(get_market_status())
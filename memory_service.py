@@ -1,89 +1,364 @@
 from sqlalchemy import text
 from score_service import engine
+from async_db import get_async_engine
+from metrics import DB_QUERY_SECONDS, BACKGROUND_WRITES, CACHE_REQUESTS
+from write_behind import WriteBehindQueue
+from collections import OrderedDict
+import change_feed
+import os
 import json
+import time
+import socket
+import hashlib
+import threading
 
-def save_portfolio_snapshot(user_id, portfolio_data, allocation, market_phase):
+LATEST_PORTFOLIO_CACHE_SIZE = int(os.getenv("LATEST_PORTFOLIO_CACHE_SIZE", 10000))
+RISK_SCORE_CACHE_SIZE = int(os.getenv("RISK_SCORE_CACHE_SIZE", 10000))
+NOTIFY_MAX_USERS = 500   # NOTIFY payloads are capped at 8000 bytes; larger batches invalidate every user
+
+# Used by save_portfolio_snapshot_async below and by loadtest/seed.py.
+# JSONB params are cast explicitly: asyncpg sends typed varchar, not untyped literals.
+# Snapshots store their composition once (portfolio_compositions, see composition_of) and
+# reference it by hash; the composition insert is a no-op when it is already stored.
+SAVE_SNAPSHOT_SQL = text("""
+    WITH c AS (
+        INSERT INTO portfolio_compositions (hash, composition)
+        VALUES (:chash, CAST(:comp AS JSONB))
+        ON CONFLICT (hash) DO NOTHING
+    )
+    INSERT INTO user_portfolios
+    (user_id, composition_hash, amount_scale, allocation_equity, allocation_debt, market_phase)
+    VALUES (:uid, :chash, :scale, :alloc_eq, :alloc_debt, :mphase)
+    RETURNING id, user_id, composition_hash, amount_scale, allocation_equity, allocation_debt, market_phase, created_at
+""")
+
+# Multi-row variants for the write-behind queue: one statement per table per batch,
+# columns passed as arrays; created_at is the time the record was queued.
+BATCH_COMPOSITION_SQL = text("""
+    INSERT INTO portfolio_compositions (hash, composition)
+    SELECT chash, CAST(comp AS JSONB)
+    FROM unnest(CAST(:chash AS CHAR(64)[]), CAST(:comp AS TEXT[])) AS t(chash, comp)
+    ON CONFLICT (hash) DO NOTHING
+""")
+
+BATCH_SNAPSHOT_SQL = text("""
+    INSERT INTO user_portfolios
+    (user_id, composition_hash, amount_scale, allocation_equity, allocation_debt, market_phase, created_at)
+    SELECT uid, chash, scale, alloc_eq, alloc_debt, mphase, to_timestamp(ts)::timestamp
+    FROM unnest(CAST(:uid AS INTEGER[]), CAST(:chash AS CHAR(64)[]), CAST(:scale AS DOUBLE PRECISION[]),
+                CAST(:alloc_eq AS NUMERIC[]), CAST(:alloc_debt AS NUMERIC[]), CAST(:mphase AS VARCHAR[]),
+                CAST(:ts AS DOUBLE PRECISION[]))
+         AS t(uid, chash, scale, alloc_eq, alloc_debt, mphase, ts)
+    RETURNING id, user_id, composition_hash, amount_scale, allocation_equity, allocation_debt, market_phase, created_at
+""")
+
+BATCH_INTERACTION_SQL = text("""
+    INSERT INTO interaction_logs (user_id, action_type, details, created_at)
+    SELECT uid, act, CAST(det AS JSONB), to_timestamp(ts)::timestamp
+    FROM unnest(CAST(:uid AS INTEGER[]), CAST(:act AS VARCHAR[]), CAST(:det AS TEXT[]),
+                CAST(:ts AS DOUBLE PRECISION[]))
+         AS t(uid, act, det, ts)
+""")
+
+RISK_SCORE_SQL = text("SELECT risk_score FROM user_profiles WHERE user_id = :uid")
+
+# Everything /recommend needs to know about the caller, in one round trip
+USER_CONTEXT_SQL = text("""
+    SELECT u.id, p.risk_score
+    FROM users u
+    LEFT JOIN user_profiles p ON p.user_id = u.id
+    WHERE u.email = :e
+    ORDER BY p.updated_at DESC NULLS LAST
+    LIMIT 1
+""")
+
+
+# Rows saved before compositions were deduplicated still carry their own portfolio_data.
+# Valuations come from the nightly mark_to_market.py (none until it has run after the save).
+LATEST_PORTFOLIO_SQL = text("""
+    SELECT COALESCE(c.composition, p.portfolio_data), p.amount_scale,
+           p.allocation_equity, p.allocation_debt, p.market_phase, p.created_at,
+           v.as_of, v.growth, v.max_drawdown, v.priced_share
+    FROM user_portfolios p
+    LEFT JOIN portfolio_compositions c ON c.hash = p.composition_hash
+    LEFT JOIN portfolio_valuations v ON v.composition_hash = p.composition_hash
+                                    AND v.saved_on = CAST(p.created_at AS DATE)
+    WHERE p.user_id = :uid
+    ORDER BY p.created_at DESC
+    LIMIT 1
+""")
+
+def composition_of(portfolio_data):
     """
-    Saves a generated portfolio to the user_portfolios table.
+    (hash, composition, scale) of a portfolio list. Each fund's amount is replaced by its share
+    of the total (the scale), so the same funds, weights, rationales and metrics share one stored
+    composition across repeats and, when amounts are proportional, across amounts.
+    expand_composition() gives back exactly the saved list; anything that would not round-trip
+    (integer or sub-paisa amounts, non-list payloads) is stored verbatim with scale None.
     """
-    if not user_id:
+    composition, scale = portfolio_data, None
+    if isinstance(portfolio_data, list) and portfolio_data and all(
+            isinstance(p, dict) and isinstance(p.get('amount'), float) for p in portfolio_data):
+        total = sum(p['amount'] for p in portfolio_data)
+        if total > 0:
+            shares = [dict(p, amount=p['amount'] / total) for p in portfolio_data]
+            if json.dumps(expand_composition(shares, total)) == json.dumps(portfolio_data):
+                composition, scale = shares, total
+    canonical = json.dumps(composition, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest(), composition, scale
+
+def expand_composition(composition, scale):
+    """The portfolio list of a stored composition at the given amount scale."""
+    if scale is None:
+        return composition
+    return [dict(p, amount=round(p['amount'] * scale, 2)) for p in composition]
+
+def _snapshot_params(user_id, portfolio_data, allocation, market_phase):
+    chash, composition, scale = composition_of(portfolio_data)
+    return {
+        'uid': user_id,
+        'chash': chash,
+        'comp': json.dumps(composition),
+        'scale': scale,
+        'alloc_eq': allocation.get('Equity', 0),
+        'alloc_debt': allocation.get('Debt', 0),
+        'mphase': market_phase
+    }
+
+def _interaction_params(user_id, action_type, details):
+    return {
+        'uid': user_id,
+        'act': action_type,
+        'det': json.dumps(details) if details else '{}'
+    }
+
+def _performance(portfolio, as_of, growth, max_drawdown, priced_share):
+    """Mark-to-market of a saved portfolio list from its portfolio_valuations row (None if not valued yet)."""
+    if as_of is None:
         return None
+    invested = sum(p['amount'] for p in portfolio
+                   if isinstance(p, dict) and isinstance(p.get('amount'), (int, float)) and p['amount'] > 0)
+    return {
+        "as_of": str(as_of),
+        "invested": round(invested, 2),
+        "current_value": round(invested * growth, 2),
+        "return_pct": round((growth - 1) * 100, 2),
+        "max_drawdown_pct": round(max_drawdown * 100, 2),
+        "priced_share": round(priced_share, 4),
+    }
 
-    try:
-        with engine.begin() as conn:
-            query = text("""
-                INSERT INTO user_portfolios 
-                (user_id, portfolio_data, allocation_equity, allocation_debt, market_phase)
-                VALUES (:uid, :pdata, :alloc_eq, :alloc_debt, :mphase)
-                RETURNING id
-            """)
-            
-            result = conn.execute(query, {
-                'uid': user_id,
-                'pdata': json.dumps(portfolio_data),
-                'alloc_eq': allocation.get('Equity', 0),
-                'alloc_debt': allocation.get('Debt', 0),
-                'mphase': market_phase
-            })
-            return result.fetchone()[0]
-    except Exception as e:
-        print(f"Error saving portfolio snapshot: {e}")
+def _latest_portfolio_row(res):
+    if not res:
         return None
+    data = res[0] if isinstance(res[0], (list, dict)) else json.loads(res[0])
+    portfolio = expand_composition(data, res[1])
+    return {
+        "portfolio": portfolio,
+        "allocation": {"Equity": res[2], "Debt": res[3]},
+        "market_phase": res[4],
+        "saved_at": str(res[5]),
+        "performance": _performance(portfolio, *res[6:10]) if isinstance(portfolio, list) else None
+    }
 
-def log_interaction(user_id, action_type, details=None):
-    """
-    Logs a user action (e.g. 'generate', 'login').
-    """
-    if not user_id:
+# --- LATEST-PORTFOLIO CACHE ---
+# user_id -> (created_at, /portfolio/latest payload or None), filled by reads and written
+# through by every save in this process. Saves also NOTIFY the other workers (change_feed,
+# PORTFOLIOS + user ids), which drop their entry; so entries are only served while the
+# feed is listening, and everything is dropped when it reconnects.
+_latest_cache = OrderedDict()
+_latest_lock = threading.Lock()
+_latest_state = {"generation": 0}   # Bumped by invalidations; a read that raced one isn't cached
+
+def _source():
+    return f"memory_service:{socket.gethostname()}:{os.getpid()}"
+
+def _cached_latest(user_id):
+    """(created_at, payload) if cached and servable, else None."""
+    if not change_feed.is_listening():
+        CACHE_REQUESTS.inc(cache='latest_portfolio', result='bypass')
+        return None
+    with _latest_lock:
+        entry = _latest_cache.get(user_id)
+        if entry is not None:
+            _latest_cache.move_to_end(user_id)
+    CACHE_REQUESTS.inc(cache='latest_portfolio', result='miss' if entry is None else 'hit')
+    return entry
+
+def _cache_latest(user_id, created_at, payload, generation=None):
+    """Cache unless an entry at least as new is there, or (reads) an invalidation happened since `generation`."""
+    with _latest_lock:
+        if generation is not None and generation != _latest_state["generation"]:
+            return
+        current = _latest_cache.get(user_id)
+        if current is not None and current[0] is not None and (created_at is None or created_at < current[0]):
+            return
+        _latest_cache[user_id] = (created_at, payload)
+        _latest_cache.move_to_end(user_id)
+        if len(_latest_cache) > LATEST_PORTFOLIO_CACHE_SIZE:
+            _latest_cache.popitem(last=False)
+
+def _cache_saved(rows, compositions):
+    """Write-through after commit: `rows` from a snapshot insert's RETURNING, compositions by hash."""
+    for row in rows:
+        latest = _latest_portfolio_row((compositions[row.composition_hash], row.amount_scale, row.allocation_equity,
+                                        row.allocation_debt, row.market_phase, row.created_at,
+                                        None, None, None, None))   # Valued by the next mark_to_market run
+        _cache_latest(row.user_id, row.created_at, latest)
+
+def _notified_users(user_ids):
+    users = sorted(set(user_ids))
+    return users if len(users) <= NOTIFY_MAX_USERS else None
+
+def invalidate_latest_portfolios(users=None, source=None):
+    """Drop cached latest portfolios of `users` (None = everyone's); saves made by this process are skipped."""
+    if source == _source():
         return
+    with _latest_lock:
+        _latest_state["generation"] += 1
+        if users is None:
+            _latest_cache.clear()
+        else:
+            for user_id in users:
+                _latest_cache.pop(user_id, None)
 
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("""
-                INSERT INTO interaction_logs (user_id, action_type, details)
-                VALUES (:uid, :act, :det)
-            """), {
-                'uid': user_id,
-                'act': action_type,
-                'det': json.dumps(details) if details else '{}'
-            })
-    except Exception as e:
-        print(f"Error logging interaction: {e}")
+# --- RISK-SCORE CACHE ---
+# (user_id, profile version) -> persisted risk score. The version is the token's "pv" claim
+# (latest user_profiles.updated_at at login), so a profile update gets a new key with the
+# next token and entries never need invalidating.
+_risk_score_cache = OrderedDict()
+_risk_score_lock = threading.Lock()
+
+def _cached_risk_score(key):
+    with _risk_score_lock:
+        if key in _risk_score_cache:
+            _risk_score_cache.move_to_end(key)
+            CACHE_REQUESTS.inc(cache='risk_score', result='hit')
+            return True, _risk_score_cache[key]
+    CACHE_REQUESTS.inc(cache='risk_score', result='miss')
+    return False, None
+
+def _cache_risk_score(key, score):
+    with _risk_score_lock:
+        _risk_score_cache[key] = score
+        if len(_risk_score_cache) > RISK_SCORE_CACHE_SIZE:
+            _risk_score_cache.popitem(last=False)
+
+def latest_cache_stats():
+    return {"entries": len(_latest_cache), "max_entries": LATEST_PORTFOLIO_CACHE_SIZE,
+            "serving": change_feed.is_listening()}
 
+@DB_QUERY_SECONDS.timed(op='risk_score')
 def get_user_risk_score(user_id):
     """
     Fetches the persisted numeric risk score if available.
     """
     if not user_id:
         return None
-        
+
     with engine.connect() as conn:
-        res = conn.execute(text("SELECT risk_score FROM user_profiles WHERE user_id = :uid"), {'uid': user_id}).fetchone()
+        res = conn.execute(RISK_SCORE_SQL, {'uid': user_id}).fetchone()
         if res:
             return res[0]
     return None
 
-def get_latest_portfolio(user_id):
+# --- ASYNC VARIANTS (FastAPI request path) ---
+
+@DB_QUERY_SECONDS.timed(op='save_snapshot')
+async def save_portfolio_snapshot_async(user_id, portfolio_data, allocation, market_phase):
+    if not user_id:
+        return None
+
+    try:
+        params = _snapshot_params(user_id, portfolio_data, allocation, market_phase)
+        async with get_async_engine().begin() as conn:
+            row = (await conn.execute(SAVE_SNAPSHOT_SQL, params)).fetchone()
+            await change_feed.notify_change_async(conn, _source(), [change_feed.PORTFOLIOS], users=[user_id])
+        _cache_saved([row], {row.composition_hash: json.loads(params['comp'])})
+        return row.id
+    except Exception as e:
+        print(f"Error saving portfolio snapshot: {e}")
+        return None
+
+async def get_user_risk_score_async(user_id, profile_version=None):
+    """
+    Persisted risk score, cached per (user_id, profile_version) when the caller's token
+    carries a profile version; tokens without one always read it.
+    """
+    if not user_id:
+        return None
+
+    key = (user_id, profile_version)
+    if profile_version is not None:
+        found, score = _cached_risk_score(key)
+        if found:
+            return score
+    with DB_QUERY_SECONDS.time(op='risk_score'):
+        async with get_async_engine().connect() as conn:
+            res = (await conn.execute(RISK_SCORE_SQL, {'uid': user_id})).fetchone()
+    score = res[0] if res else None
+    if profile_version is not None:
+        _cache_risk_score(key, score)
+    return score
+
+@DB_QUERY_SECONDS.timed(op='user_context')
+async def get_user_context_async(email):
     """
-    Retrieves the most recent portfolio for the user.
+    (user_id, risk_score) for `email` in a single query; (None, None) if unknown.
     """
+    async with get_async_engine().connect() as conn:
+        res = (await conn.execute(USER_CONTEXT_SQL, {'e': email})).fetchone()
+        return (res[0], res[1]) if res else (None, None)
+
+# --- WRITE-BEHIND (fire-and-forget records from the request path) ---
+
+def _columns(rows):
+    """[{col: value}] -> {col: [values]} for the unnest() batch statements."""
+    return {k: [r[k] for r in rows] for k in rows[0]}
+
+async def _write_records(batch):
+    """Insert a batch of ("snapshot" | "interaction", params) records in one transaction."""
+    snapshots = [params for kind, params in batch if kind == "snapshot"]
+    interactions = [params for kind, params in batch if kind == "interaction"]
+    compositions = {p['chash']: p['comp'] for p in snapshots}   # Repeats within the batch sent once
+    saved = []
+    async with get_async_engine().begin() as conn:
+        if snapshots:
+            await conn.execute(BATCH_COMPOSITION_SQL, {'chash': list(compositions), 'comp': list(compositions.values())})
+            saved = (await conn.execute(BATCH_SNAPSHOT_SQL, _columns([{k: v for k, v in p.items() if k != 'comp'}
+                                                                      for p in snapshots]))).fetchall()
+            await change_feed.notify_change_async(conn, _source(), [change_feed.PORTFOLIOS],
+                                                  users=_notified_users(p['uid'] for p in snapshots))
+        if interactions:
+            await conn.execute(BATCH_INTERACTION_SQL, _columns(interactions))
+    _cache_saved(saved, {h: json.loads(c) for h, c in compositions.items()})
+
+write_queue = WriteBehindQueue("memory", _write_records)
+
+async def record_recommendation_async(user_id, portfolio_data, allocation, market_phase):
+    """
+    Queue the snapshot + interaction log of a generated portfolio. Runs as a background
+    task after /recommend has responded; rows from many requests share one batch insert.
+    """
+    if not user_id:
+        return
+
+    now = time.time()
+    queued = await write_queue.put(
+        ("snapshot", dict(_snapshot_params(user_id, portfolio_data, allocation, market_phase), ts=now)))
+    queued = await write_queue.put(
+        ("interaction", dict(_interaction_params(user_id, 'generate_portfolio', allocation), ts=now))) and queued
+    BACKGROUND_WRITES.inc(result='queued' if queued else 'dropped')
+
+async def get_latest_portfolio_async(user_id):
     if not user_id: return None
-    
-    with engine.connect() as conn:
-        query = text("""
-            SELECT portfolio_data, allocation_equity, allocation_debt, market_phase, created_at
-            FROM user_portfolios 
-            WHERE user_id = :uid 
-            ORDER BY created_at DESC 
-            LIMIT 1
-        """)
-        res = conn.execute(query, {'uid': user_id}).fetchone()
-        
-        if res:
-            return {
-                "portfolio": json.loads(res[0]),
-                "allocation": {"Equity": res[1], "Debt": res[2]},
-                "market_phase": res[3],
-                "saved_at": str(res[4])
-            }
-    return None
+
+    entry = _cached_latest(user_id)
+    if entry is not None:
+        return entry[1]
+    generation = _latest_state["generation"]
+    with DB_QUERY_SECONDS.time(op='latest_portfolio'):
+        async with get_async_engine().connect() as conn:
+            res = (await conn.execute(LATEST_PORTFOLIO_SQL, {'uid': user_id})).fetchone()
+    latest = _latest_portfolio_row(res)
+    _cache_latest(user_id, res[5] if res else None, latest, generation)
+    return latest
@@ -0,0 +1,163 @@
+# metrics.py
+# ---------------------------------------------------------------------------
+# Minimal in-process metrics with Prometheus text exposition (GET /metrics).
+#
+# Recording is a dict lookup + a few additions under a per-metric lock;
+# nothing is formatted until a scrape calls render(), so an unscraped
+# process pays next to nothing. Hit ratios are derived at query time, e.g.
+#   sum(rate(mf_cache_requests_total{result="hit"}[5m])) by (cache)
+#     / sum(rate(mf_cache_requests_total[5m])) by (cache)
+# ---------------------------------------------------------------------------
+import time
+import bisect
+import inspect
+import functools
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+
+def _fmt_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+
+def _fmt_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines += self._render_samples(items)
+        return "\n".join(lines)
+
+    def _render_samples(self, items):
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}" for k, v in items]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def timed(self, **labels):
+        """Decorator timing every call of a sync or async function."""
+        def wrap(fn):
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def async_inner(*args, **kwargs):
+                    with self.time(**labels):
+                        return await fn(*args, **kwargs)
+                return async_inner
+
+            @functools.wraps(fn)
+            def inner(*args, **kwargs):
+                with self.time(**labels):
+                    return fn(*args, **kwargs)
+            return inner
+        return wrap
+
+    def _render_samples(self, items):
+        lines = []
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                le = _fmt_labels(self.labelnames, key, [("le", _fmt_value(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_value(total)}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {n}")
+        return lines
+
+
+def render():
+    """All registered metrics in Prometheus text format 0.0.4."""
+    return "\n".join(m.render() for m in REGISTRY) + "\n"
+
+
+# --- Shared metrics ---
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "mf_http_request_seconds", "HTTP request latency by route.", ["method", "route", "status"])
+HTTP_IN_FLIGHT = Gauge(
+    "mf_http_requests_in_flight", "HTTP requests currently being served, by route.", ["method", "route"])
+RECOMMEND_STAGE_SECONDS = Histogram(
+    "mf_recommend_stage_seconds", "Time spent in each stage of generate_portfolio.", ["stage"])
+DB_QUERY_SECONDS = Histogram(
+    "mf_db_query_seconds", "Database call latency by operation.", ["op"])
+AUTH_SECONDS = Histogram(
+    "mf_auth_seconds", "Password hashing/verification and token decoding time.", ["op"])
+BACKGROUND_WRITES = Counter(
+    "mf_background_writes_total", "Writes handed off after the response was sent, by outcome.", ["result"])
+CACHE_REQUESTS = Counter(
+    "mf_cache_requests_total", "Cache lookups by cache and result (hit, miss, ...).", ["cache", "result"])
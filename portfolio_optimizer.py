@@ -0,0 +1,199 @@
+# portfolio_optimizer.py
+# ---------------------------------------------------------------------------
+# Weight optimisers for a sleeve (Equity or Debt) of slot candidates.
+#
+# All solvers work on the small covariance sub-matrix of the candidates
+# (top-K per slot, so n is ~5-15) with plain numpy:
+#   - min-variance: primal active-set QP (exact, a handful of small solves)
+#   - max-Sharpe:   golden-section search along the mean-variance frontier
+#   - risk parity:  Newton's method on the convex log-barrier formulation
+# Weights are long-only, sum to 1 and are capped per fund.
+# ---------------------------------------------------------------------------
+import numpy as np
+
+OPTIMIZER_MODES = ('min_variance', 'risk_parity', 'max_sharpe')
+
+RISK_FREE_RATE = 0.04     # Same rf as compute_features.py Sharpe
+MAX_FUND_WEIGHT = 0.60    # Cap per fund within a sleeve
+MIN_FUND_WEIGHT = 0.05    # Weights below this are dropped and the rest renormalised
+MAX_ITER = 50
+FRONTIER_STEPS = 16       # Golden-section evaluations for max-Sharpe
+EPS = 1e-10
+
+
+def project_capped_simplex(v, cap):
+    """
+    Euclidean projection of v onto {w : sum(w) = 1, 0 <= w <= cap}.
+    g(tau) = sum(clip(v - tau, 0, cap)) is piecewise linear and decreasing,
+    so evaluate it at every breakpoint at once and interpolate.
+    """
+    n = len(v)
+    cap = max(cap, 1.0 / n)
+    taus = np.sort(np.concatenate([v, v - cap]))
+    g = np.clip(v[None, :] - taus[:, None], 0, cap).sum(axis=1)  # decreasing in tau
+    k = np.searchsorted(-g, -1.0)  # first breakpoint with g <= 1
+    if k == 0:
+        tau = taus[0]
+    elif k >= len(taus):
+        tau = taus[-1]
+    else:
+        t0, t1, g0, g1 = taus[k - 1], taus[k], g[k - 1], g[k]
+        tau = t1 if g0 == g1 else t0 + (g0 - 1.0) * (t1 - t0) / (g0 - g1)
+    return np.clip(v - tau, 0, cap)
+
+
+def solve_budget_qp(Q, c, cap, w0=None):
+    """
+    min 1/2 w'Qw - c'w  s.t. sum(w) = 1, 0 <= w <= cap   (primal active set)
+
+    `w0` (any feasible point, e.g. a neighbouring solution) warm-starts the
+    active set, which usually leaves one or two small solves to do.
+    """
+    n = len(Q)
+    cap = max(cap, 1.0 / n)
+    w = np.full(n, 1.0 / n) if w0 is None else np.array(w0, dtype=float)
+    at_lower = w <= EPS
+    at_upper = w >= cap - EPS
+
+    for _ in range(MAX_ITER * 2):
+        free = ~(at_lower | at_upper)
+        F = np.flatnonzero(free)
+        if len(F) == 0:
+            break
+        fixed = np.where(at_upper, cap, 0.0)
+
+        # Equality-constrained subproblem on the free set: [Q_FF 1; 1' 0][w_F; mu] = [rhs; budget]
+        k = len(F)
+        K = np.zeros((k + 1, k + 1))
+        K[:k, :k] = Q[np.ix_(F, F)]
+        K[:k, k] = 1.0
+        K[k, :k] = 1.0
+        rhs = np.append(c[F] - Q[F][:, ~free] @ fixed[~free], 1.0 - fixed.sum())
+        try:
+            sol = np.linalg.solve(K, rhs)
+        except np.linalg.LinAlgError:
+            sol = np.linalg.lstsq(K, rhs, rcond=None)[0]
+        target = fixed.copy()
+        target[F] = sol[:k]
+
+        # Walk towards the subproblem optimum until a free weight hits a bound
+        d = (target - w)[F]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            a_low = np.where(d < -EPS, -w[F] / d, np.inf)
+            a_up = np.where(d > EPS, (cap - w[F]) / d, np.inf)
+        i_low, i_up = np.argmin(a_low), np.argmin(a_up)
+        alpha = min(a_low[i_low], a_up[i_up])
+        if alpha < 1.0:
+            w[F] = np.clip(w[F] + alpha * d, 0.0, cap)
+            if a_low[i_low] <= a_up[i_up]:
+                at_lower[F[i_low]] = True
+                w[F[i_low]] = 0.0
+            else:
+                at_upper[F[i_up]] = True
+                w[F[i_up]] = cap
+            continue
+
+        w = target
+        # KKT: release the bound with the most violated multiplier, else optimal
+        g = Q @ w - c + sol[k]
+        viol = np.where(at_lower, -g, 0.0) + np.where(at_upper, g, 0.0)
+        j = np.argmax(viol)
+        if viol[j] <= 1e-12:
+            break
+        at_lower[j] = at_upper[j] = False
+    return np.clip(w, 0.0, cap)
+
+
+def min_variance_weights(cov, cap=MAX_FUND_WEIGHT):
+    return solve_budget_qp(2 * cov, np.zeros(len(cov)), cap)
+
+
+def max_sharpe_weights(cov, exp_returns, rf=RISK_FREE_RATE, cap=MAX_FUND_WEIGHT):
+    """
+    Sharpe is unimodal along the frontier w(g) = argmin w'Σw - g·excess'w, so
+    golden-section search over log(g) finds the (capped, long-only) tangency mix.
+    """
+    excess = np.asarray(exp_returns, dtype=float) - rf
+    if (excess <= 0).all():
+        # No candidate beats cash: the least-risk mix is the sensible answer
+        return min_variance_weights(cov, cap)
+
+    last = [None]
+
+    def frontier(log_g):
+        last[0] = solve_budget_qp(2 * cov, np.exp(log_g) * excess, cap, w0=last[0])
+        return last[0]
+
+    def sharpe(w):
+        return (excess @ w) / (np.sqrt(w @ cov @ w) + EPS)
+
+    scale = np.log(np.trace(cov) / len(cov) / (np.abs(excess).max() + EPS))
+    lo, hi = scale - 6.0, scale + 6.0
+    ratio = (np.sqrt(5) - 1) / 2
+    x1, x2 = hi - ratio * (hi - lo), lo + ratio * (hi - lo)
+    w1, w2 = frontier(x1), frontier(x2)
+    f1, f2 = sharpe(w1), sharpe(w2)
+    for _ in range(FRONTIER_STEPS):
+        if f1 < f2:
+            lo, x1, w1, f1 = x1, x2, w2, f2
+            x2 = lo + ratio * (hi - lo)
+            w2 = frontier(x2)
+            f2 = sharpe(w2)
+        else:
+            hi, x2, w2, f2 = x2, x1, w1, f1
+            x1 = hi - ratio * (hi - lo)
+            w1 = frontier(x1)
+            f1 = sharpe(w1)
+    return w1 if f1 >= f2 else w2
+
+
+def risk_parity_weights(cov, cap=MAX_FUND_WEIGHT):
+    """
+    Equal risk contribution: minimise 1/2 x'Σx - (1/n)·sum(log x) (Spinu) by damped
+    Newton, then w = x / sum(x), projected onto the per-fund cap.
+    """
+    n = len(cov)
+    b = np.full(n, 1.0 / n)
+    x = 1.0 / np.sqrt(np.maximum(np.diag(cov), EPS))
+    x *= np.sqrt(1.0 / (x @ cov @ x))
+    for _ in range(MAX_ITER):
+        grad = cov @ x - b / x
+        if np.abs(grad).max() < 1e-10:
+            break
+        step = np.linalg.solve(cov + np.diag(b / x ** 2), grad)
+        alpha = 1.0
+        while (x - alpha * step <= 0).any():
+            alpha *= 0.5
+        x = x - alpha * step
+    w = x / x.sum()
+    return project_capped_simplex(w, cap) if w.max() > cap else w
+
+
+def optimize_weights(mode, cov, exp_returns=None, cap=MAX_FUND_WEIGHT, min_weight=MIN_FUND_WEIGHT):
+    """
+    Sleeve weights (sum 1) for `mode` in OPTIMIZER_MODES.
+    Tiny positions are dropped so the UI doesn't show 1% holdings, and the rest
+    projected back onto the per-fund cap (a plain renormalisation could exceed it).
+    """
+    cov = np.asarray(cov, dtype=float)
+    n = len(cov)
+    if n == 0:
+        return np.array([])
+    if n == 1:
+        return np.array([1.0])
+
+    if mode == 'min_variance':
+        w = min_variance_weights(cov, cap)
+    elif mode == 'risk_parity':
+        w = risk_parity_weights(cov, cap)
+    elif mode == 'max_sharpe':
+        w = max_sharpe_weights(cov, exp_returns, cap=cap)
+    else:
+        raise ValueError(f"Unknown optimizer mode: {mode}")
+
+    keep = w >= min_weight
+    if not keep.any():
+        return np.full(n, 1.0 / n)
+    out = np.zeros(n)
+    out[keep] = project_capped_simplex(w[keep], cap)
+    return out
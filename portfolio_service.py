@@ -1,7 +1,58 @@
+import os
+import time
 import pandas as pd
-from score_service import recommend, load_latest_features, engine
-from market_service import get_market_status
+from score_service import recommend, compute_scores, load_latest_features, get_scored_snapshot, engine
+from market_service import get_market_status, wait_for_first_refresh, MARKET_REFRESH_TIMEOUT_SECONDS
 from reasoning_engine import explain_portfolio, generate_confidence_score
+from risk_model import get_risk_model, MAX_PAIR_CORRELATION
+from portfolio_optimizer import optimize_weights, OPTIMIZER_MODES
+from metrics import RECOMMEND_STAGE_SECONDS
+
+SLOT_CANDIDATES = 5  # Candidates considered per slot when skipping near-duplicates
+
+# Optimizer mode used when the request doesn't pick one (unset = fixed slot weights)
+DEFAULT_OPTIMIZER = os.getenv("PORTFOLIO_OPTIMIZER") or None
+if DEFAULT_OPTIMIZER and DEFAULT_OPTIMIZER not in OPTIMIZER_MODES:
+    raise RuntimeError(f"PORTFOLIO_OPTIMIZER must be one of {list(OPTIMIZER_MODES)}, got {DEFAULT_OPTIMIZER!r}")
+
+# Slot definitions for optimizer mode: (category fallbacks, fixed weight, rationale).
+# Fixed weights mirror the explicit slots in generate_portfolio.
+EQUITY_SLOTS_GROWTH = [
+    (['Large Cap', 'Index Fund'], 0.50, "Core Anchor (Large Cap)"),
+    (['Mid Cap'], 0.30, "Growth Booster (Mid Cap)"),
+    (['Small Cap'], 0.20, "High Alpha Potential (Small Cap)"),
+]
+EQUITY_SLOTS_DEFENSIVE = [
+    (['Large Cap', 'Index Fund'], 0.60, "Core Anchor (Large Cap)"),
+    (['Flexi Cap'], 0.40, "Stable Growth (Flexi Cap)"),
+]
+
+def _lap(stage, t0):
+    """Record time since `t0` for `stage`; returns the new start time."""
+    now = time.perf_counter()
+    RECOMMEND_STAGE_SECONDS.observe(now - t0, stage=stage)
+    return now
+
+def debt_slots(user_profile):
+    yield_cat = 'Gilt' if user_profile.get('risk_tolerance') == 'Low' else 'Corporate Bond'
+    return [
+        (['Liquid'], 0.60, "Liquid Fund for Emergency access & Low Risk"),
+        ([yield_cat, 'Debt'], 0.40, f"{yield_cat} for consistent yield (AUM > 1000Cr)"),
+    ]
+
+def pick_diversified(candidates, selected_ids, risk_model):
+    """
+    First candidate not already held and not highly correlated with any holding.
+    Falls back to the first candidate not already held if all are too correlated.
+    """
+    fresh = [f for f in candidates if f['fund_id'] not in selected_ids]
+    if risk_model is None:
+        return fresh[0] if fresh else None
+    for f in fresh:
+        corr = risk_model.max_correlation(f['fund_id'], selected_ids)
+        if corr is None or corr <= MAX_PAIR_CORRELATION:
+            return f
+    return fresh[0] if fresh else None
 
 def allocate_assets(user_profile, market_phase):
     """
@@ -46,12 +97,65 @@ def allocate_assets(user_profile, market_phase):
     debt_base = 1.0 - equity_base
     return {'Equity': round(equity_base, 2), 'Debt': round(debt_base, 2)}
 
-def generate_portfolio(user_profile):
+def fund_item(f, asset_class, amount, total_amount, rationale):
+    return {
+        "fund_id": f['fund_id'], "fund_name": f.get('fund_name'), "category": f.get('category'),
+        "asset_class": asset_class, "weight": round(amount / total_amount, 4),
+        "amount": round(amount, 2), "score": round(f.get('TotalScore', 0), 2),
+        "rationale": rationale,
+        "metrics": {
+            "sharpe": round(f.get('sharpe', 0), 2),
+            "volatility": round(f.get('ann_vol', 0)*100, 1),
+            "returns": round(f.get('ann_return', 0)*100, 1)
+        }
+    }
+
+def optimized_sleeve(user_profile, slots, asset_class, budget, total_amount, mode,
+                     scored, risk_model, exclude_ids=()):
+    """
+    Optimizer mode: pool the top-K candidates of every slot in a sleeve and let
+    the optimizer split `budget` between them (instead of the fixed slot weights).
+    """
+    candidates, rationales = [], {}
+    for categories, _, rationale in slots:
+        recs = []
+        for cat in categories:
+            recs = recommend(user_profile, category_filter=cat, topk=SLOT_CANDIDATES, scored=scored).to_dict('records')
+            if recs:
+                break
+        for f in recs:
+            if f['fund_id'] not in exclude_ids and f['fund_id'] not in rationales:
+                candidates.append(f)
+                rationales[f['fund_id']] = rationale
+
+    if not candidates:
+        return []
+
+    cov, _ = risk_model.sub_cov(
+        [f['fund_id'] for f in candidates],
+        fallback_vol={f['fund_id']: f.get('ann_vol') for f in candidates}
+    )
+    exp_returns = [f['ann_return'] if pd.notna(f.get('ann_return')) else 0.0 for f in candidates]
+    weights = optimize_weights(mode, cov, exp_returns=exp_returns)
+
+    return [
+        fund_item(f, asset_class, budget * w, total_amount, rationales[f['fund_id']])
+        for f, w in zip(candidates, weights) if w > 0
+    ]
+
+def generate_portfolio(user_profile, market_status=None, df_features=None, risk_model=None):
     """
     Construct a portfolio (Combo) for the user w/ Reasoning.
+
+    `user_profile['optimizer']` (or PORTFOLIO_OPTIMIZER) switches slot weights from
+    the fixed split to one of OPTIMIZER_MODES. Market status, features and risk
+    model can be passed in (benchmarks, offline runs); otherwise they are loaded.
     """
     # 1. Get Market Context
-    market_status = get_market_status()
+    t = time.perf_counter()
+    if market_status is None:
+        market_status = get_market_status()
+        t = _lap('market_status', t)
     market_phase = market_status['phase']
     
     # 2. Determine Allocation
@@ -59,8 +163,23 @@ def generate_portfolio(user_profile):
     total_amount = float(user_profile.get('amount') or 10000)
     current_investment = float(user_profile.get('current_investments') or 0)
     
-    # 3. Load Data
-    df_features = load_latest_features(engine)
+    # 3. Load Data (the latest snapshot is loaded and scored once per process)
+    if df_features is None:
+        df_features, scored = get_scored_snapshot()
+        t = _lap('load_features', t)
+    else:
+        scored = compute_scores(df_features.copy(), user_profile)
+        t = _lap('scoring', t)
+    if risk_model is None:
+        risk_model = get_risk_model(engine, df_features)
+        t = _lap('risk_model', t)
+
+    optimizer_mode = user_profile.get('optimizer') or DEFAULT_OPTIMIZER
+    if optimizer_mode and optimizer_mode not in OPTIMIZER_MODES:
+        raise ValueError(f"Unknown optimizer mode: {optimizer_mode}")
+    if optimizer_mode and risk_model is None:
+        print(f"Risk model unavailable, falling back to fixed slot weights (requested {optimizer_mode})")
+        optimizer_mode = None
     
     portfolio = []
     
@@ -79,10 +198,10 @@ def generate_portfolio(user_profile):
         equity_budget -= (gold_budget * 0.5)
         debt_budget -= (gold_budget * 0.5)
         
-        gold_funds = recommend(user_profile, category_filter='Commodity', topk=1, df=df_features).to_dict('records')
+        gold_funds = recommend(user_profile, category_filter='Commodity', topk=1, scored=scored).to_dict('records')
         # If no explicit commodity fund, try Gold
         if not gold_funds:
-             gold_funds = recommend(user_profile, category_filter='Gold', topk=1, df=df_features).to_dict('records')
+             gold_funds = recommend(user_profile, category_filter='Gold', topk=1, scored=scored).to_dict('records')
              
         if gold_funds:
             f = gold_funds[0]
@@ -100,67 +219,78 @@ def generate_portfolio(user_profile):
     
 
 
+    # --- OPTIMIZER MODE (weights chosen among top-K candidates per slot) ---
+    if optimizer_mode:
+        held = {p['fund_id'] for p in portfolio}
+        if equity_budget > 0:
+            risk_profile = user_profile.get('risk_tolerance', 'Moderate').lower()
+            slots = EQUITY_SLOTS_DEFENSIVE if risk_profile in ('low', 'conservative', 'safety') else EQUITY_SLOTS_GROWTH
+            portfolio += optimized_sleeve(user_profile, slots, "Equity", equity_budget, total_amount,
+                                          optimizer_mode, scored, risk_model, exclude_ids=held)
+        if debt_budget > 0:
+            portfolio += optimized_sleeve(user_profile, debt_slots(user_profile), "Debt", debt_budget, total_amount,
+                                          optimizer_mode, scored, risk_model, exclude_ids=held)
+
     # --- EQUITY STRATEGY (Explicit Slots) ---
-    if equity_budget > 0:
+    if equity_budget > 0 and not optimizer_mode:
         risk_profile = user_profile.get('risk_tolerance', 'Moderate').lower()
         selected_ids = {p['fund_id'] for p in portfolio}
 
         def add_equity_slot(candidate_list, weight_pct, slot_rationale):
-             for f in candidate_list:
-                 if f['fund_id'] not in selected_ids:
-                     amt = equity_budget * weight_pct
-                     portfolio.append({
-                        "fund_id": f['fund_id'], 
-                        "fund_name": f.get('fund_name'), 
-                        "category": f.get('category'),
-                        "asset_class": "Equity", 
-                        "weight": round(amt / total_amount, 4),
-                        "amount": round(amt, 2), 
-                        "score": round(f.get('TotalScore', 0), 2),
-                        "rationale": slot_rationale,
-                        "metrics": {
-                            "sharpe": round(f.get('sharpe', 0), 2),
-                            "volatility": round(f.get('ann_vol', 0)*100, 1),
-                            "returns": round(f.get('ann_return', 0)*100, 1)
-                        }
-                     })
-                     selected_ids.add(f['fund_id'])
-                     return
+             f = pick_diversified(candidate_list, selected_ids, risk_model)
+             if f:
+                 amt = equity_budget * weight_pct
+                 portfolio.append({
+                    "fund_id": f['fund_id'], 
+                    "fund_name": f.get('fund_name'), 
+                    "category": f.get('category'),
+                    "asset_class": "Equity", 
+                    "weight": round(amt / total_amount, 4),
+                    "amount": round(amt, 2), 
+                    "score": round(f.get('TotalScore', 0), 2),
+                    "rationale": slot_rationale,
+                    "metrics": {
+                        "sharpe": round(f.get('sharpe', 0), 2),
+                        "volatility": round(f.get('ann_vol', 0)*100, 1),
+                        "returns": round(f.get('ann_return', 0)*100, 1)
+                    }
+                 })
+                 selected_ids.add(f['fund_id'])
 
         # Strategy A: High/Moderate Risk -> Large + Mid + Small
         if risk_profile not in ('low', 'conservative', 'safety'):
              # Slot 1: Large (50%)
-             f_large = recommend(user_profile, category_filter='Large Cap', topk=1, df=df_features).to_dict('records')
-             if not f_large: f_large = recommend(user_profile, category_filter='Index Fund', topk=1, df=df_features).to_dict('records')
+             f_large = recommend(user_profile, category_filter='Large Cap', topk=SLOT_CANDIDATES, scored=scored).to_dict('records')
+             if not f_large: f_large = recommend(user_profile, category_filter='Index Fund', topk=SLOT_CANDIDATES, scored=scored).to_dict('records')
              add_equity_slot(f_large, 0.50, "Core Anchor (Large Cap)")
 
              # Slot 2: Mid (30%)
-             f_mid = recommend(user_profile, category_filter='Mid Cap', topk=2, df=df_features).to_dict('records')
+             f_mid = recommend(user_profile, category_filter='Mid Cap', topk=SLOT_CANDIDATES, scored=scored).to_dict('records')
              add_equity_slot(f_mid, 0.30, "Growth Booster (Mid Cap)")
 
              # Slot 3: Small (20%)
-             f_small = recommend(user_profile, category_filter='Small Cap', topk=2, df=df_features).to_dict('records')
+             f_small = recommend(user_profile, category_filter='Small Cap', topk=SLOT_CANDIDATES, scored=scored).to_dict('records')
              add_equity_slot(f_small, 0.20, "High Alpha Potential (Small Cap)")
 
         # Strategy B: Low Risk -> Large + Flexi
         else:
              # Slot 1: Large (60%)
-             f_large = recommend(user_profile, category_filter='Large Cap', topk=1, df=df_features).to_dict('records')
-             if not f_large: f_large = recommend(user_profile, category_filter='Index Fund', topk=1, df=df_features).to_dict('records')
+             f_large = recommend(user_profile, category_filter='Large Cap', topk=SLOT_CANDIDATES, scored=scored).to_dict('records')
+             if not f_large: f_large = recommend(user_profile, category_filter='Index Fund', topk=SLOT_CANDIDATES, scored=scored).to_dict('records')
              add_equity_slot(f_large, 0.60, "Core Anchor (Large Cap)")
 
              # Slot 2: Flexi (40%)
-             f_flexi = recommend(user_profile, category_filter='Flexi Cap', topk=2, df=df_features).to_dict('records')
+             f_flexi = recommend(user_profile, category_filter='Flexi Cap', topk=SLOT_CANDIDATES, scored=scored).to_dict('records')
              add_equity_slot(f_flexi, 0.40, "Stable Growth (Flexi Cap)")
 
 
     # --- DEBT STRATEGY ---
-    if debt_budget > 0:
+    if debt_budget > 0 and not optimizer_mode:
         # A. Safety: Liquid Fund (60% of Debt)
         safe_amt = debt_budget * 0.60
-        safe_funds = recommend(user_profile, category_filter='Liquid', topk=1, df=df_features).to_dict('records')
-        if safe_funds:
-            f = safe_funds[0]
+        safe_funds = recommend(user_profile, category_filter='Liquid', topk=SLOT_CANDIDATES, scored=scored).to_dict('records')
+        f = pick_diversified(safe_funds, {p['fund_id'] for p in portfolio if p['asset_class'] == 'Debt'}, risk_model)
+        if f:
             portfolio.append({
                 "fund_id": f['fund_id'], "fund_name": f.get('fund_name'), "category": f.get('category'),
                 "asset_class": "Debt", "weight": round(safe_amt / total_amount, 4),
@@ -176,12 +306,12 @@ def generate_portfolio(user_profile):
         # B. Yield: Corporate Bond / Gilt (40% of Debt)
         yield_amt = debt_budget * 0.40
         yield_cat = 'Gilt' if user_profile.get('risk_tolerance') == 'Low' else 'Corporate Bond'
-        yield_funds = recommend(user_profile, category_filter=yield_cat, topk=1, df=df_features).to_dict('records')
+        yield_funds = recommend(user_profile, category_filter=yield_cat, topk=SLOT_CANDIDATES, scored=scored).to_dict('records')
         if not yield_funds: 
-             yield_funds = recommend(user_profile, category_filter='Debt', topk=1, df=df_features).to_dict('records')
+             yield_funds = recommend(user_profile, category_filter='Debt', topk=SLOT_CANDIDATES, scored=scored).to_dict('records')
 
-        if yield_funds:
-            f = yield_funds[0]
+        f = pick_diversified(yield_funds, {p['fund_id'] for p in portfolio if p['asset_class'] == 'Debt'}, risk_model)
+        if f:
             portfolio.append({
                 "fund_id": f['fund_id'], "fund_name": f.get('fund_name'), "category": f.get('category'),
                 "asset_class": "Debt", "weight": round(yield_amt / total_amount, 4),
@@ -194,6 +324,8 @@ def generate_portfolio(user_profile):
                 }
             })
 
+    t = _lap('slot_selection', t)
+
     # 5. RECALCULATE WEIGHTS & ALLOCATION (Bottom-Up)
     # Ensure consistency: Sum of weights = 100%, Allocation based on actuals
     
@@ -227,19 +359,40 @@ def generate_portfolio(user_profile):
     for k in actual_allocation:
         actual_allocation[k] = round(actual_allocation[k], 2)
 
+    # Portfolio risk from the covariance model (funds outside it fall back to own ann_vol)
+    weights = {p['fund_id']: p['weight'] for p in portfolio}
+    risk_metrics = None
+    if risk_model is not None and weights:
+        own_vol = df_features[df_features['fund_id'].isin(weights)].set_index('fund_id')['ann_vol'].to_dict()
+        stats = risk_model.portfolio_stats(weights, fallback_vol=own_vol)
+        risk_metrics = {
+            "portfolio_volatility": round(stats['volatility'] * 100, 1),
+            "avg_correlation": round(stats['avg_correlation'], 2),
+            "diversification_ratio": round(stats['diversification_ratio'], 2)
+        }
+    t = _lap('risk_metrics', t)
+
     # 6. Generate Explanation
     # Construct a temporary structure to pass to reasoning engine
     temp_data = {"user_profile": user_profile, "allocation": actual_allocation}
     explanation = explain_portfolio(temp_data, market_status)
+    t = _lap('explanation', t)
 
     # 7. Calculate Confidence Score
-    stability_score = generate_confidence_score(portfolio, market_phase)
+    stability_score = generate_confidence_score(
+        portfolio, market_phase,
+        avg_correlation=risk_metrics['avg_correlation'] if risk_metrics else None
+    )
+    t = _lap('confidence_score', t)
 
     # 8. Structure Output for UI
-    # Explicitly filter by asset_class (now cleaned up)
-    equity_schemes = [p for p in portfolio if p['asset_class'] == 'Equity']
-    debt_schemes = [p for p in portfolio if p['asset_class'] == 'Debt']
-    commodity_schemes = [p for p in portfolio if p['asset_class'] == 'Commodity']
+    # Sections hold indices into `portfolio` (by asset_class, now cleaned up)
+    # rather than copies of the items, so each fund is serialized once.
+    sections = {"equity": [], "debt": [], "commodity": []}
+    for i, p in enumerate(portfolio):
+        key = p['asset_class'].lower()
+        if key in sections:
+            sections[key].append(i)
     
     # We pass 'sections' dynamically. Frontend handles keys it knows (Equity, Debt)
     # But updated frontend also handles 'Commodities / Gold' via flat list filter.
@@ -251,11 +404,8 @@ def generate_portfolio(user_profile):
         "market_status": market_status,
         "allocation": actual_allocation, # NOW THE TRUTH
         "portfolio": portfolio, 
-        "sections": {
-            "equity": equity_schemes,
-            "debt": debt_schemes,
-            "commodity": commodity_schemes
-        },
+        "sections": sections,
+        "risk_metrics": risk_metrics,
         "breakdown": {
             "lump_sum_total": total_pk,
             "sip_total": round(total_pk * 0.015, 0)
@@ -266,6 +416,32 @@ def generate_portfolio(user_profile):
     }
 
 
+def warm_up():
+    """
+    Load everything the first /recommend would otherwise pay for: the scored
+    feature snapshot, the risk model and market status, then run one dry
+    portfolio so the pandas/numpy code paths are exercised. Returns seconds per stage.
+    """
+    timings = {}
+    t0 = time.perf_counter()
+    df_features, _ = get_scored_snapshot()
+    timings['features'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    get_risk_model(engine, df_features)
+    timings['risk_model'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    wait_for_first_refresh(MARKET_REFRESH_TIMEOUT_SECONDS + 5)
+    market_status = get_market_status()
+    timings['market_status'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    generate_portfolio({'amount': 100000, 'horizon_years': 5, 'risk_tolerance': 'Moderate'}, market_status=market_status)
+    timings['dry_run'] = time.perf_counter() - t0
+    return {k: round(v, 3) for k, v in timings.items()}
+
+
 def get_alternatives(limit=5):
     """
     Returns alternative funds for each category to support 'What else?' queries.
@@ -0,0 +1,120 @@
+# profiler.py
+# ---------------------------------------------------------------------------
+# Opt-in sampling profiler for single requests.
+#
+# A profiled request gets a sampler thread that snapshots the stacks of the
+# threads doing its work (sys._current_frames) every PROFILE_INTERVAL_SECONDS.
+# Work offloaded through main.run_cpu registers its worker thread via the
+# `current_profile` context variable. Nothing runs for unprofiled requests.
+#
+# Output is the collapsed-stack format ("outer;inner;leaf count" per line)
+# read by flamegraph.pl, speedscope and inferno. The last PROFILE_STORE_SIZE
+# profiles are kept in memory.
+# ---------------------------------------------------------------------------
+import os
+import sys
+import time
+import uuid
+import threading
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_SECONDS", 0.005))
+PROFILE_STORE_SIZE = int(os.getenv("PROFILE_STORE_SIZE", 50))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", 60))   # Sampler stops itself after this
+
+current_profile = ContextVar("current_profile", default=None)
+
+_store = OrderedDict()   # profile_id -> Profile
+_store_lock = threading.Lock()
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profile:
+    def __init__(self, label):
+        self.id = uuid.uuid4().hex[:12]
+        self.label = label
+        self.started_at = time.time()
+        self.duration = None
+        self.samples = Counter()   # collapsed stack -> sample count
+        self._threads = {}         # ident -> registration count
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        self._sampler = threading.Thread(target=self._run, name=f"profiler-{self.id}", daemon=True)
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.duration = time.time() - self.started_at
+
+    def wrap(self, fn):
+        """Wrap `fn` so the thread running it is sampled while it runs."""
+        def run(*args, **kwargs):
+            ident = threading.get_ident()
+            with self._lock:
+                self._threads[ident] = self._threads.get(ident, 0) + 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._threads[ident] -= 1
+                    if not self._threads[ident]:
+                        del self._threads[ident]
+        return run
+
+    def _run(self):
+        deadline = time.monotonic() + PROFILE_MAX_SECONDS
+        while not self._stop.wait(PROFILE_INTERVAL_SECONDS) and time.monotonic() < deadline:
+            with self._lock:
+                idents = list(self._threads)
+            if not idents:
+                continue
+            frames = sys._current_frames()
+            for ident in idents:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                if stack:
+                    self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {n}\n" for stack, n in self.samples.most_common())
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "label": self.label,
+            "started_at": self.started_at,
+            "duration_seconds": round(self.duration, 4) if self.duration is not None else None,
+            "samples": sum(self.samples.values()),
+            "interval_seconds": PROFILE_INTERVAL_SECONDS,
+        }
+
+
+def save(profile):
+    with _store_lock:
+        _store[profile.id] = profile
+        while len(_store) > PROFILE_STORE_SIZE:
+            _store.popitem(last=False)
+
+
+def get(profile_id):
+    with _store_lock:
+        return _store.get(profile_id)
+
+
+def list_profiles():
+    with _store_lock:
+        return [p.summary() for p in reversed(_store.values())]
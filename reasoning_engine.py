@@ -1,9 +1,9 @@
-def generate_confidence_score(portfolio, market_phase):
+def generate_confidence_score(portfolio, market_phase, avg_correlation=None):
     """
     Calculates a 0-100 stability score based on:
     1. Market Phase Alignment (e.g. High Debt in Overheated market = Good)
     2. Fund quality (Average Scores)
-    3. Diversification
+    3. Diversification (weighted avg pairwise correlation from the risk model, if available)
     """
     score = 70.0 # Base score
     
@@ -23,6 +23,10 @@ def generate_confidence_score(portfolio, market_phase):
     avg_fund_score = sum(p.get('score', 50) for p in portfolio) / len(portfolio) if portfolio else 0
     # Normalize fund score to add up to 20 points
     score += (avg_fund_score / 100.0) * 20
+
+    # 3. Diversification: +5 for uncorrelated holdings, -5 for holdings moving in lockstep
+    if avg_correlation is not None and len(portfolio) > 1:
+        score += (0.5 - avg_correlation) * 10
     
     # Cap at 99
     return min(99.0, round(score, 1))
@@ -0,0 +1,260 @@
+# risk_model.py
+# ---------------------------------------------------------------------------
+# Fund return covariance model for the latest fund_features snapshot.
+#
+# Built once per snapshot (nightly, after compute_features.py) from monthly
+# NAV returns of the eligible universe, shrunk towards its own diagonal so
+# that short/noisy histories don't produce spurious correlations, then cached
+# in-process and on disk keyed by the snapshot's as_of_date.
+# ---------------------------------------------------------------------------
+import os
+import math
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from sqlalchemy import text
+from metrics import CACHE_REQUESTS
+
+COV_LOOKBACK_MONTHS = 36   # Window of monthly returns used for the estimate
+COV_MIN_OBS = 12           # Funds with fewer monthly returns are left out of the model
+MAX_PAIR_CORRELATION = 0.90  # Candidates more correlated than this with a holding are skipped
+
+CACHE_DIR = Path(os.getenv("MF_CACHE_DIR", Path(__file__).parent / "cache"))
+
+RISK_MODEL_RETRY_SECONDS = float(os.getenv("RISK_MODEL_RETRY_SECONDS", 300))   # After a build found no model
+
+_models = {}  # as_of (str) -> RiskModel
+_failed = {}  # as_of (str) -> time.monotonic() of the last build that produced no model
+
+
+def _finite_or_zero(v):
+    """Fallback volatilities come straight from fund_features: None and NaN mean unknown."""
+    try:
+        v = float(v)
+    except (TypeError, ValueError):
+        return 0.0
+    return v if np.isfinite(v) else 0.0
+
+
+class RiskModel:
+    """
+    Annualised, shrunk covariance matrix over a fixed list of fund ids.
+    """
+    def __init__(self, as_of, fund_ids, cov, shrinkage):
+        self.as_of = str(as_of)
+        self.fund_ids = [str(f) for f in fund_ids]
+        self.cov = np.asarray(cov, dtype=float)
+        self.shrinkage = float(shrinkage)
+        self.index = {fid: i for i, fid in enumerate(self.fund_ids)}
+        self.vol = np.sqrt(np.clip(np.diag(self.cov), 0, None))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = self.cov / np.outer(self.vol, self.vol)
+        self.corr = np.nan_to_num(corr, nan=0.0)
+        np.fill_diagonal(self.corr, 1.0)
+
+    def __contains__(self, fund_id):
+        return str(fund_id) in self.index
+
+    def max_correlation(self, fund_id, others):
+        """
+        Highest correlation between `fund_id` and any of `others`.
+        Returns None when the fund (or all of `others`) is outside the model.
+        """
+        i = self.index.get(str(fund_id))
+        idx = [self.index[str(o)] for o in others if str(o) in self.index and str(o) != str(fund_id)]
+        if i is None or not idx:
+            return None
+        return float(self.corr[i, idx].max())
+
+    def sub_cov(self, fund_ids, fallback_vol=None):
+        """
+        Covariance sub-matrix for `fund_ids` (in order) and their volatilities.
+        Funds outside the model use `fallback_vol[fund_id]` (annualised, e.g. ann_vol
+        from fund_features) and are treated as uncorrelated with everything else.
+        """
+        fallback_vol = fallback_vol or {}
+        ids = [str(f) for f in fund_ids]
+        vols = np.array([
+            self.vol[self.index[f]] if f in self.index else _finite_or_zero(fallback_vol.get(f))
+            for f in ids
+        ])
+        corr = np.eye(len(ids))
+        known = [k for k, f in enumerate(ids) if f in self.index]
+        if known:
+            model_idx = [self.index[ids[k]] for k in known]
+            corr[np.ix_(known, known)] = self.corr[np.ix_(model_idx, model_idx)]
+        return corr * np.outer(vols, vols), vols
+
+    def portfolio_stats(self, weights, fallback_vol=None):
+        """
+        Volatility of a portfolio given {fund_id: weight} (see sub_cov for fallback_vol).
+
+        Returns dict with 'volatility', 'avg_correlation' and 'diversification_ratio'.
+        """
+        w = np.array([float(weights[f]) for f in weights])
+        if len(w) == 0 or w.sum() <= 0:
+            return {'volatility': 0.0, 'avg_correlation': 0.0, 'diversification_ratio': 1.0}
+
+        cov, vols = self.sub_cov(list(weights), fallback_vol)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.nan_to_num(cov / np.outer(vols, vols), nan=0.0)
+        np.fill_diagonal(corr, 1.0)
+        port_vol = math.sqrt(max(float(w @ cov @ w), 0.0))
+
+        # Weighted average pairwise correlation (off-diagonal only)
+        pair_w = np.outer(w, w)
+        np.fill_diagonal(pair_w, 0.0)
+        avg_corr = float((pair_w * corr).sum() / pair_w.sum()) if pair_w.sum() > 0 else 1.0
+
+        div_ratio = float(w @ vols) / port_vol if port_vol > 0 else 1.0
+        return {
+            'volatility': port_vol,
+            'avg_correlation': avg_corr,
+            'diversification_ratio': div_ratio,
+        }
+
+
+def fetch_monthly_returns(engine, fund_ids, as_of, months=COV_LOOKBACK_MONTHS):
+    """
+    Month-end NAV returns for `fund_ids` over the `months` before `as_of`,
+    as a (month x fund_id) DataFrame. One query for the whole universe.
+    """
+    as_of = pd.to_datetime(as_of)
+    start = (as_of - pd.DateOffset(months=months + 1)).date()
+    sql = text("""
+        SELECT fund_id, nav_date, nav FROM navs
+        WHERE fund_id = ANY(:ids) AND nav_date > :start AND nav_date <= :as_of
+          AND nav IS NOT NULL
+    """)
+    navs = pd.read_sql(sql, engine, params={'ids': [str(f) for f in fund_ids], 'start': start, 'as_of': as_of.date()},
+                       parse_dates=['nav_date'])
+    if navs.empty:
+        return pd.DataFrame()
+
+    navs['fund_id'] = navs['fund_id'].astype(str)
+    wide = navs.pivot_table(index='nav_date', columns='fund_id', values='nav', aggfunc='last')
+    monthly = wide.astype(float).resample('ME').last().pct_change(fill_method=None)
+    return monthly.iloc[1:].tail(months)
+
+
+def shrink_covariance(returns):
+    """
+    Ledoit-Wolf style shrinkage of the sample covariance towards its diagonal.
+
+    `returns` is a (T x N) array of periodic returns, NaN where a fund has no data.
+    Missing observations are treated as the fund's mean (zero after demeaning).
+    Returns (covariance (N x N), shrinkage intensity in [0, 1]).
+    """
+    X = np.asarray(returns, dtype=float)
+    T = X.shape[0]
+    X = X - np.nanmean(X, axis=0)
+    X = np.nan_to_num(X, nan=0.0)
+
+    S = X.T @ X / T
+    # Asymptotic variance of each sample covariance entry
+    X2 = X ** 2
+    pi = X2.T @ X2 / T - S ** 2
+
+    off = ~np.eye(S.shape[0], dtype=bool)
+    d2 = float((S[off] ** 2).sum())
+    b2 = float(pi[off].sum()) / T
+    delta = min(1.0, max(0.0, b2 / d2)) if d2 > 0 else 1.0
+
+    cov = (1 - delta) * S
+    cov[np.diag_indices_from(cov)] = np.diag(S)
+    return cov, delta
+
+
+def build_risk_model(engine, df_features=None):
+    """
+    Build (and persist) the risk model for the latest snapshot's eligible universe.
+    """
+    from score_service import load_latest_features, apply_constraints
+
+    if df_features is None:
+        df_features = load_latest_features(engine)
+    if df_features.empty:
+        return None
+
+    as_of = pd.to_datetime(df_features['as_of_date']).max()
+    eligible = apply_constraints(df_features.copy())
+    monthly = fetch_monthly_returns(engine, eligible['fund_id'].astype(str).unique(), as_of)
+    if monthly.empty:
+        return None
+
+    monthly = monthly.loc[:, monthly.notna().sum() >= COV_MIN_OBS]
+    cov, delta = shrink_covariance(monthly.values)
+    model = RiskModel(as_of.date(), monthly.columns, cov * 12, delta)  # annualise monthly covariance
+
+    save_risk_model(model)
+    _models[model.as_of] = model
+    print(f"Risk model built for {model.as_of}: {len(model.fund_ids)} funds, shrinkage={delta:.2f}")
+    return model
+
+
+def _model_path(as_of):
+    return CACHE_DIR / f"risk_model_{as_of}.npz"
+
+
+def save_risk_model(model):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = CACHE_DIR / f".risk_model_{model.as_of}.tmp.npz"
+    np.savez(tmp, fund_ids=np.array(model.fund_ids), cov=model.cov, shrinkage=model.shrinkage)
+    os.replace(tmp, _model_path(model.as_of))
+
+
+def load_risk_model(as_of):
+    path = _model_path(as_of)
+    if not path.exists():
+        return None
+    data = np.load(path)
+    return RiskModel(as_of, data['fund_ids'].tolist(), data['cov'], data['shrinkage'])
+
+
+def get_risk_model(engine, df_features):
+    """
+    Risk model for the snapshot in `df_features`: memory -> disk -> build.
+    Never raises; portfolio construction proceeds without it on failure. A snapshot
+    with no model is retried at most every RISK_MODEL_RETRY_SECONDS.
+    """
+    as_of = None
+    try:
+        as_of = str(pd.to_datetime(df_features['as_of_date']).max().date())
+        model = _models.get(as_of)
+        if model is not None:
+            CACHE_REQUESTS.inc(cache='risk_model', result='hit')
+            return model
+        # A build that found nothing (no NAVs) isn't retried on every request
+        failed_at = _failed.get(as_of)
+        if failed_at is not None and time.monotonic() - failed_at < RISK_MODEL_RETRY_SECONDS:
+            CACHE_REQUESTS.inc(cache='risk_model', result='negative')
+            return None
+
+        model = load_risk_model(as_of)
+        CACHE_REQUESTS.inc(cache='risk_model', result='disk' if model is not None else 'miss')
+        model = model or build_risk_model(engine, df_features)
+        if model is not None:
+            _models.clear()  # keep only the current snapshot
+            _models[as_of] = model
+            _failed.pop(as_of, None)
+        else:
+            _failed.clear()
+            _failed[as_of] = time.monotonic()
+        return model
+    except Exception as e:
+        print(f"Error loading risk model: {e}")
+        if as_of is not None:
+            _failed.clear()
+            _failed[as_of] = time.monotonic()
+        return None
+
+
+if __name__ == "__main__":
+    from score_service import engine
+    import time
+    t0 = time.perf_counter()
+    m = build_risk_model(engine)
+    if m is not None:
+        print(f"Built in {time.perf_counter() - t0:.2f}s")
@@ -1,10 +1,14 @@
 # score_service.py
 import os
 import json
+import time
+import threading
 import pandas as pd
 import numpy as np
 from sqlalchemy import create_engine, text
 from datetime import date
+from metrics import CACHE_REQUESTS
+import change_feed
 
 DB_URL = os.getenv("DB_URL")
 if not DB_URL:
@@ -29,6 +33,20 @@ DEBT_CATEGORIES = [
 ]
 # BANNED: 'Credit Risk', 'Floater', 'Medium Duration' (if high risk)
 
+# Latest snapshot is loaded and scored once, then re-checked (one MAX(as_of_date)
+# query) at most every FEATURES_REFRESH_SECONDS. With SHARED_SNAPSHOT (default)
+# that happens once across all worker processes, which attach to a shared
+# memory-mapped copy (snapshot_store); set SHARED_SNAPSHOT=0 for per-process copies.
+# While the API is listening for change notifications (change_feed) the re-check
+# is only a safety net and runs every CHANGE_FEED_POLL_SECONDS instead.
+FEATURES_REFRESH_SECONDS = int(os.getenv("FEATURES_REFRESH_SECONDS", 300))
+SHARED_SNAPSHOT = os.getenv("SHARED_SNAPSHOT", "1") != "0"
+
+# data = (features, scored); as_of = snapshot date (local) or published version (shared);
+# force = time of a change that needs a reload even if MAX(as_of_date) hasn't moved (0 = none)
+_snapshot = {"data": None, "as_of": None, "checked_at": 0.0, "force": 0.0, "recheck": False}
+_snapshot_lock = threading.Lock()
+
 def load_latest_features(engine):
     # load latest features snapshot
     q = "SELECT * FROM fund_features WHERE as_of_date = (SELECT MAX(as_of_date) FROM fund_features)"
@@ -265,16 +283,142 @@ def compute_scores(df, user_profile):
     
     return df
 
+def save_scores(engine, scored, as_of):
+    """
+    Persist ConsistencyScore and tier (1/2/3) of a scored snapshot into fund_scores,
+    replacing any previous scores for `as_of`.
+    """
+    rows = [
+        {'fid': str(r.fund_id), 'd': as_of, 's': round(float(r.ConsistencyScore), 2), 't': int(str(r.Tier).split()[1])}
+        for r in scored[['fund_id', 'ConsistencyScore', 'Tier']].itertuples(index=False)
+    ]
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM fund_scores WHERE as_of_date = :d"), {'d': as_of})
+        if rows:
+            conn.execute(text("""
+                INSERT INTO fund_scores (fund_id, as_of_date, score, tier) VALUES (:fid, :d, :s, :t)
+            """), rows)
+    return len(rows)
+
 def extract_recommendations(scored_df, topk=3):
     return scored_df.head(topk)
 
 # --- COMPATIBILITY WRAPPERS ---
 
-def recommend(user_profile, category_filter=None, topk=3, persist=False, df=None):
-    if df is None:
-        df = load_latest_features(engine)
-    
-    scored = compute_scores(df, user_profile)
+def _latest_as_of():
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT MAX(as_of_date) FROM fund_features")).scalar()
+
+def _load_and_score():
+    features = load_latest_features(engine)
+    return features, compute_scores(features.copy(), {})
+
+def _refresh_local(force=0.0):
+    """Per-process snapshot: load + score here when MAX(as_of_date) moved (or `force`)."""
+    as_of = _latest_as_of()
+    if force or _snapshot["data"] is None or as_of != _snapshot["as_of"]:
+        _snapshot["data"], _snapshot["as_of"] = _load_and_score(), as_of
+        CACHE_REQUESTS.inc(cache='scored_snapshot', result='miss')
+    else:
+        CACHE_REQUESTS.inc(cache='scored_snapshot', result='revalidated')
+
+def _refresh_shared(force=0.0, recheck=False):
+    """
+    Shared snapshot (snapshot_store): only the process holding the publisher lock
+    queries Postgres, at most once per refresh interval across all workers
+    (or right away with `recheck`), and publishes a new version when the data
+    moved (or the CURRENT version was published before `force`). Every process
+    then attaches to the CURRENT version (zero-copy) if it isn't already on it.
+    """
+    import snapshot_store
+
+    with snapshot_store.publisher_lock() as is_publisher:
+        if is_publisher:
+            pointer = snapshot_store.read_pointer()
+            # A change seen by several workers is republished by the first of them only
+            force = bool(force) and (pointer is None or pointer.get("published_at", 0.0) < force)
+            interval = change_feed.poll_interval(FEATURES_REFRESH_SECONDS)
+            if force or recheck or pointer is None or time.time() - pointer["checked_at"] >= interval:
+                as_of = str(_latest_as_of())
+                if force or pointer is None or pointer["as_of"] != as_of:
+                    features, scored = _load_and_score()
+                    snapshot_store.write_snapshot({"features": features, "scored": scored}, as_of)
+                    print(f"Published scored snapshot {as_of} ({len(scored)} funds)")
+                else:
+                    pointer["checked_at"] = time.time()
+                    snapshot_store.write_pointer(pointer)
+
+    pointer = snapshot_store.read_pointer()
+    if pointer is None:
+        # Another worker is publishing the very first version: don't wait for it
+        _refresh_local()
+        return
+    if pointer["version"] != _snapshot["as_of"]:
+        tables = snapshot_store.attach(pointer)
+        _snapshot["data"], _snapshot["as_of"] = (tables["features"], tables["scored"]), pointer["version"]
+        CACHE_REQUESTS.inc(cache='scored_snapshot', result='attach')
+    else:
+        CACHE_REQUESTS.inc(cache='scored_snapshot', result='revalidated')
+
+def get_scored_snapshot():
+    """
+    (features, scored) for the latest fund_features snapshot, shared by all requests
+    (and, with SHARED_SNAPSHOT, by all worker processes). Treat both frames as read-only.
+    """
+    interval = change_feed.poll_interval(FEATURES_REFRESH_SECONDS)
+    if _snapshot["data"] is not None and time.monotonic() - _snapshot["checked_at"] < interval:
+        CACHE_REQUESTS.inc(cache='scored_snapshot', result='hit')
+        return _snapshot["data"]
+
+    with _snapshot_lock:
+        if _snapshot["data"] is not None and time.monotonic() - _snapshot["checked_at"] < interval:
+            CACHE_REQUESTS.inc(cache='scored_snapshot', result='hit')
+            return _snapshot["data"]
+        force, _snapshot["force"] = _snapshot["force"], 0.0
+        recheck, _snapshot["recheck"] = _snapshot["recheck"], False
+        if SHARED_SNAPSHOT:
+            try:
+                _refresh_shared(force, recheck)
+            except Exception as e:
+                print(f"Shared snapshot unavailable, loading locally: {e}")
+                _refresh_local(force)
+        else:
+            _refresh_local(force)
+        _snapshot["checked_at"] = time.monotonic()
+        return _snapshot["data"]
+
+def invalidate_snapshot(force=False, changed_at=None, version=None):
+    """
+    Re-check the snapshot version on the next get_scored_snapshot();
+    `force` reloads and republishes even if MAX(as_of_date) is unchanged
+    (e.g. funds metadata changed), unless the shared version was already
+    published after `changed_at` (default: now). A `version` announced by
+    the job that this process isn't on (it may have been published on
+    another host or MF_CACHE_DIR) makes the next refresh query
+    MAX(as_of_date) even if the shared pointer was checked recently.
+    """
+    if force:
+        _snapshot["force"] = max(_snapshot["force"], changed_at or time.time())
+    if version is not None and version != _snapshot["as_of"]:
+        _snapshot["recheck"] = True
+    _snapshot["checked_at"] = 0.0
+
+def publish_snapshot():
+    """Load, score and publish the latest snapshot for API workers (batch jobs)."""
+    import snapshot_store
+    features, scored = _load_and_score()
+    return snapshot_store.write_snapshot({"features": features, "scored": scored}, str(_latest_as_of()))
+
+def recommend(user_profile, category_filter=None, topk=3, persist=False, df=None, scored=None):
+    """
+    Top `topk` funds, optionally within a category. Pass `scored` (output of
+    compute_scores) to reuse one scoring pass across calls; otherwise `df`
+    (or the latest snapshot) is scored here.
+    """
+    if scored is None:
+        if df is None:
+            df = load_latest_features(engine)
+        scored = compute_scores(df, user_profile)
     
     # Apply Category Filter if requested
     if category_filter:
@@ -0,0 +1,108 @@
+# snapshot_cache.py
+# ---------------------------------------------------------------------------
+# Server-side response cache + ETags for read-only fund endpoints.
+#
+# Fund data only changes when a new fund_features/fund_scores snapshot or a
+# funds update (fetch_aum, fix_categories) lands. The "snapshot version"
+# fingerprints all three and is polled at most every SNAPSHOT_POLL_SECONDS
+# (much less often while change_feed delivers invalidations from those jobs);
+# rendered JSON bodies are kept per version, so repeat calls skip SQL and
+# serialization entirely, and clients revalidating with If-None-Match get a
+# bodyless 304.
+# ---------------------------------------------------------------------------
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from fastapi import Request, Response
+from sqlalchemy import text
+from async_db import get_async_engine
+from fast_json import dumps
+from metrics import CACHE_REQUESTS
+import change_feed
+
+SNAPSHOT_POLL_SECONDS = float(os.getenv("SNAPSHOT_POLL_SECONDS", 30))
+SNAPSHOT_CACHE_MAX_ENTRIES = int(os.getenv("SNAPSHOT_CACHE_MAX_ENTRIES", 4096))   # Rendered bodies kept (LRU)
+CACHE_CONTROL = "private, max-age=0, must-revalidate"
+
+SNAPSHOT_VERSION_SQL = text("""
+    SELECT (SELECT MAX(as_of_date) FROM fund_features),
+           (SELECT MAX(as_of_date) FROM fund_scores),
+           (SELECT md5(string_agg(fund_id || ':' || COALESCE(category, '') || ':' || COALESCE(aum_cr::text, ''),
+                                  ',' ORDER BY fund_id))
+            FROM funds)
+""")
+
+_state = {"version": None, "etag": None, "checked_at": 0.0}
+_bodies = OrderedDict()   # key -> rendered JSON bytes, for _state["version"] only
+_poll_lock = None
+
+
+async def current_version():
+    """(version, etag) of the fund snapshot, re-read from the DB at most every poll interval."""
+    global _poll_lock
+    interval = change_feed.poll_interval(SNAPSHOT_POLL_SECONDS)
+    if time.monotonic() - _state["checked_at"] < interval and _state["version"] is not None:
+        return _state["version"], _state["etag"]
+
+    if _poll_lock is None:
+        _poll_lock = asyncio.Lock()
+    async with _poll_lock:
+        # Another request may have polled while we waited
+        if time.monotonic() - _state["checked_at"] >= interval or _state["version"] is None:
+            async with get_async_engine().connect() as conn:
+                as_of, scores_as_of, funds_hash = (await conn.execute(SNAPSHOT_VERSION_SQL)).fetchone()
+            set_version(f"{as_of}:{scores_as_of}:{funds_hash}")
+    return _state["version"], _state["etag"]
+
+
+def set_version(version):
+    """Record the snapshot version; a change drops every cached body."""
+    if version != _state["version"]:
+        _bodies.clear()
+        _state["version"] = version
+        _state["etag"] = '"' + hashlib.sha1(version.encode()).hexdigest()[:20] + '"'
+    _state["checked_at"] = time.monotonic()
+
+
+def invalidate():
+    """Forget the snapshot version and bodies; the next request re-polls."""
+    _bodies.clear()
+    _state["version"] = None
+    _state["checked_at"] = 0.0
+
+
+def _not_modified(request, etag):
+    inm = request.headers.get("if-none-match")
+    if not inm:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in inm.split(",")]
+    return "*" in tags or etag in tags
+
+
+async def cached_json(request: Request, key, build):
+    """
+    Response for `key` under the current snapshot: the cached body, else `await build()`
+    rendered once and cached; 304 instead if the client already has it. The body is
+    looked up (or built) first, so exceptions from `build` (e.g. 404) propagate even to
+    a matching If-None-Match, and nothing is cached for them.
+    """
+    version, etag = await current_version()
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    body = _bodies.get(key)
+    not_modified = _not_modified(request, etag)
+    CACHE_REQUESTS.inc(cache='fund_bodies', result='miss' if body is None else
+                       'not_modified' if not_modified else 'hit')
+    if body is None:
+        data = await build()
+        body = dumps(data)
+        if _state["version"] == version:   # Don't cache a body rendered across a version change
+            _bodies[key] = body
+            if len(_bodies) > SNAPSHOT_CACHE_MAX_ENTRIES:
+                _bodies.popitem(last=False)
+    else:
+        _bodies.move_to_end(key)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
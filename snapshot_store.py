@@ -0,0 +1,183 @@
+# snapshot_store.py
+# ---------------------------------------------------------------------------
+# Scored fund universe shared across uvicorn worker processes.
+#
+# One process (whoever holds publish.lock) loads + scores the latest snapshot
+# and writes it once into a columnar file under MF_CACHE_DIR/snapshots:
+#
+#   MAGIC | header length (u64) | JSON header | 64-byte aligned column buffers
+#
+# The header carries the version and, per table/column, dtype + offsets.
+# Workers mmap the file read-only; numeric/datetime columns become DataFrame
+# columns without copying (the page cache holds one copy for all workers),
+# strings are decoded once per attach. Publishing writes a new file and then
+# atomically replaces the CURRENT pointer, so a worker either sees the old
+# version or the new one; files it already mapped stay valid after cleanup.
+# ---------------------------------------------------------------------------
+import os
+import json
+import time
+import fcntl
+from pathlib import Path
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = Path(os.getenv("MF_CACHE_DIR", Path(__file__).parent / "cache"))
+SNAPSHOT_DIR = CACHE_DIR / "snapshots"
+POINTER_FILE = SNAPSHOT_DIR / "CURRENT"
+LOCK_FILE = SNAPSHOT_DIR / "publish.lock"
+KEEP_VERSIONS = 3
+
+MAGIC = b"MFSNAP01"
+ALIGN = 64
+INDEX_COLUMN = "__index__"
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _encode_column(series):
+    """(spec, [buffers]) for one column. Numeric/bool/datetime are stored raw; the rest as UTF-8."""
+    values = series.to_numpy()
+    dtype = series.dtype
+    if dtype.kind in "fiub":
+        return {"kind": "raw", "dtype": values.dtype.str}, [np.ascontiguousarray(values)]
+    if dtype.kind == "M":
+        unit = np.datetime_data(values.dtype)[0]
+        return {"kind": "datetime", "unit": unit}, [np.ascontiguousarray(values.view("i8"))]
+
+    # Object columns that are all null or all numbers (e.g. NUMERIC read as object) -> float64
+    non_null = series.dropna()
+    if non_null.map(lambda v: isinstance(v, (int, float, np.number)) and not isinstance(v, bool)).all():
+        return {"kind": "raw", "dtype": "<f8"}, [pd.to_numeric(series, errors="coerce").to_numpy("f8")]
+
+    nulls = series.isna().to_numpy()
+    encoded = [b"" if n else str(v).encode() for v, n in zip(values, nulls)]
+    offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype="u1")
+    return {"kind": "str"}, [offsets, nulls.astype("u1"), blob]
+
+
+def write_snapshot(tables, as_of):
+    """
+    Write {name: DataFrame} as a new snapshot version and make it CURRENT.
+    Returns the pointer dict.
+    """
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    version = f"{as_of}-{time.time_ns()}"
+    header = {"version": version, "as_of": as_of, "tables": {}}
+    buffers = []
+    offset = 0
+    for name, df in tables.items():
+        frame = df.reset_index(names=INDEX_COLUMN) if INDEX_COLUMN not in df.columns else df
+        cols = []
+        for col in frame.columns:
+            spec, bufs = _encode_column(frame[col])
+            spec["name"] = col
+            spec["buffers"] = []
+            for b in bufs:
+                spec["buffers"].append({"offset": offset, "nbytes": b.nbytes, "dtype": b.dtype.str})
+                buffers.append((offset, b))
+                offset = _align(offset + b.nbytes)
+            cols.append(spec)
+        header["tables"][name] = {"rows": len(frame), "columns": cols}
+
+    header_bytes = json.dumps(header).encode()
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+    path = SNAPSHOT_DIR / f"snapshot_{version}.bin"
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for off, b in buffers:
+            f.seek(data_start + off)
+            f.write(b.tobytes())
+        f.truncate(data_start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+    now = time.time()
+    pointer = {"version": version, "file": path.name, "as_of": as_of, "published_at": now, "checked_at": now}
+    write_pointer(pointer)
+    _cleanup()
+    return pointer
+
+
+def _cleanup():
+    files = sorted(SNAPSHOT_DIR.glob("snapshot_*.bin"), key=lambda p: p.stat().st_mtime)
+    for p in files[:-KEEP_VERSIONS]:
+        try:
+            p.unlink()   # Workers still mapping it keep their pages until they swap
+        except OSError:
+            pass
+
+
+def write_pointer(pointer):
+    tmp = POINTER_FILE.with_suffix(".tmp")
+    tmp.write_text(json.dumps(pointer))
+    os.replace(tmp, POINTER_FILE)
+
+
+def read_pointer():
+    try:
+        return json.loads(POINTER_FILE.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def publisher_lock():
+    """Yields True if this process holds the publisher lock (non-blocking), else False."""
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    with open(LOCK_FILE, "a+") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def attach(pointer):
+    """Map the snapshot named by `pointer` read-only; returns {name: DataFrame}."""
+    buf = np.memmap(SNAPSHOT_DIR / pointer["file"], dtype="u1", mode="r")
+    if bytes(buf[:len(MAGIC)]) != MAGIC:
+        raise ValueError(f"Not a snapshot file: {pointer['file']}")
+    header_len = int(buf[len(MAGIC):len(MAGIC) + 8].view("<u8")[0])
+    header = json.loads(bytes(buf[len(MAGIC) + 8:len(MAGIC) + 8 + header_len]))
+    data_start = _align(len(MAGIC) + 8 + header_len)
+
+    def view(b):
+        start = data_start + b["offset"]
+        return buf[start:start + b["nbytes"]].view(b["dtype"])
+
+    tables = {}
+    for name, table in header["tables"].items():
+        columns = {}
+        for spec in table["columns"]:
+            arrays = [view(b) for b in spec["buffers"]]
+            if spec["kind"] == "raw":
+                columns[spec["name"]] = arrays[0]
+            elif spec["kind"] == "datetime":
+                columns[spec["name"]] = arrays[0].view(f"M8[{spec['unit']}]")
+            else:
+                offsets, nulls, blob = arrays
+                raw = blob.tobytes()
+                columns[spec["name"]] = np.array(
+                    [None if nulls[i] else raw[offsets[i]:offsets[i + 1]].decode() for i in range(table["rows"])],
+                    dtype=object
+                )
+        df = pd.DataFrame(columns, copy=False)
+        if INDEX_COLUMN in df.columns:
+            df = df.set_index(INDEX_COLUMN)
+            df.index.name = None
+        tables[name] = df
+    return tables
@@ -0,0 +1,141 @@
+# traffic_recorder.py
+# ---------------------------------------------------------------------------
+# Opt-in recorder of production request bodies for replay (loadtest/replay.py).
+#
+# Set TRAFFIC_RECORD_DIR and TRAFFIC_RECORD_KEY to record /recommend,
+# /chat/message and /simulate bodies (TRAFFIC_RECORD_SAMPLE of them) as
+# gzipped JSON lines:
+#   {"t": epoch seconds, "ep": "/recommend", "u": user pseudonym, "b": body}
+# Each worker process writes its own traffic-<start>-<pid>.jsonl.gz; the
+# replayer merges them by time.
+#
+# Bodies are sanitized before they are queued: user ids are replaced by an
+# HMAC under TRAFFIC_RECORD_KEY (stable, so one user's requests stay
+# together; without the key, ids can't be recovered from a log, so nothing is
+# recorded when it is unset), free text (chat messages, goals) has emails and
+# long digit runs masked, and only fields the endpoints read are kept.
+# The request path only pays for a queue put; a daemon thread compresses and
+# writes, and drops records (counted) if it falls behind.
+# ---------------------------------------------------------------------------
+import os
+import re
+import json
+import gzip
+import hmac
+import time
+import queue
+import random
+import hashlib
+import threading
+from pathlib import Path
+from metrics import Counter
+
+TRAFFIC_RECORD_DIR = os.getenv("TRAFFIC_RECORD_DIR")   # Unset = recording off
+TRAFFIC_RECORD_KEY = os.getenv("TRAFFIC_RECORD_KEY")   # Pseudonym key, kept out of the logs; unset = recording off
+TRAFFIC_RECORD_SAMPLE = float(os.getenv("TRAFFIC_RECORD_SAMPLE", 1.0))
+TRAFFIC_RECORD_MAX_MB = float(os.getenv("TRAFFIC_RECORD_MAX_MB", 256))   # Per process; recording stops after
+FLUSH_SECONDS = 1.0
+QUEUE_SIZE = 10000
+
+TRAFFIC_RECORDS = Counter("mf_traffic_records_total", "Recorded request bodies by outcome.", ["endpoint", "result"])
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+")
+_DIGITS = re.compile(r"\d{6,}")   # Phone, account and PAN-like numbers; amounts in chat rarely need 6+ digits
+_FUND_KEYS = ("fund_id", "fund_name", "category", "asset_class", "weight", "amount", "score", "rationale", "metrics")
+
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+_writer = None
+_writer_lock = threading.Lock()
+_state = {"path": None, "bytes": 0, "full": False}
+
+
+def enabled():
+    return bool(TRAFFIC_RECORD_DIR and TRAFFIC_RECORD_KEY)
+
+
+if TRAFFIC_RECORD_DIR and not TRAFFIC_RECORD_KEY:
+    print("TRAFFIC_RECORD_DIR is set but TRAFFIC_RECORD_KEY is not: traffic recording is off")
+
+
+def pseudonym(user_id):
+    if user_id is None:
+        return None
+    return hmac.new(TRAFFIC_RECORD_KEY.encode(), str(user_id).encode(), hashlib.sha256).hexdigest()[:12]
+
+
+def _scrub(text):
+    return _DIGITS.sub("<number>", _EMAIL.sub("<email>", text or ""))
+
+
+def sanitize(endpoint, body):
+    if endpoint == "/chat/message":
+        funds = ((body.get("context") or {}).get("funds")) or []
+        out = {"message": _scrub(body.get("message"))}
+        if funds:
+            out["context"] = {"funds": [{k: f.get(k) for k in _FUND_KEYS if k in f} for f in funds]}
+        return out
+    if endpoint == "/simulate":
+        return {"scenario_id": body.get("scenario_id"),
+                "portfolio": [{k: p.get(k) for k in _FUND_KEYS if k in p} for p in body.get("portfolio", [])]}
+    out = dict(body)   # /recommend: the UserProfile fields, no identity
+    if out.get("goal"):
+        out["goal"] = _scrub(out["goal"])
+    return out
+
+
+def record(endpoint, body, user_id=None):
+    """Queue one sanitized request body; no-op unless recording is enabled. `user_id` is the numeric id."""
+    if not enabled() or _state["full"]:
+        return
+    if TRAFFIC_RECORD_SAMPLE < 1.0 and random.random() >= TRAFFIC_RECORD_SAMPLE:
+        return
+    _ensure_writer()
+    try:
+        _queue.put_nowait({"t": round(time.time(), 3), "ep": endpoint, "u": pseudonym(user_id),
+                           "b": sanitize(endpoint, body)})
+    except queue.Full:
+        TRAFFIC_RECORDS.inc(endpoint=endpoint, result="dropped")
+
+
+def _ensure_writer():
+    global _writer
+    if _writer is not None:
+        return
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_loop, name="traffic-recorder", daemon=True)
+            _writer.start()
+
+
+def _write_loop():
+    directory = Path(TRAFFIC_RECORD_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"traffic-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}.jsonl.gz"
+    _state["path"] = str(path)
+    limit = TRAFFIC_RECORD_MAX_MB * 1024 * 1024
+    print(f"Recording traffic to {path}")
+
+    with gzip.open(path, "ab") as f:
+        last_flush = time.monotonic()
+        while True:
+            try:
+                rec = _queue.get(timeout=FLUSH_SECONDS)
+            except queue.Empty:
+                rec = None
+            if rec is not None:
+                line = json.dumps(rec, separators=(",", ":"), default=str).encode() + b"\n"
+                f.write(line)
+                _state["bytes"] += len(line)
+                TRAFFIC_RECORDS.inc(endpoint=rec["ep"], result="written")
+            if time.monotonic() - last_flush >= FLUSH_SECONDS:
+                f.flush()   # Readable up to here even if the process dies
+                last_flush = time.monotonic()
+            if _state["bytes"] >= limit:
+                _state["full"] = True
+                print(f"Traffic recording stopped: {TRAFFIC_RECORD_MAX_MB:.0f} MB (uncompressed) written to {path}")
+                return
+
+
+def stats():
+    return {"enabled": enabled(), "path": _state["path"], "bytes": _state["bytes"], "full": _state["full"],
+            "queued": _queue.qsize()}
@@ -0,0 +1,192 @@
+# write_behind.py
+# ---------------------------------------------------------------------------
+# In-process write-behind queue for fire-and-forget inserts (interaction logs,
+# generated-portfolio snapshots).
+#
+# Records are buffered in memory and handed to an async `writer(batch)` that
+# inserts the whole batch in one transaction, as soon as WRITE_BEHIND_BATCH_SIZE
+# records are pending or WRITE_BEHIND_FLUSH_MS after the previous flush.
+# Memory is bounded by WRITE_BEHIND_MAX_PENDING: producers then wait up to
+# WRITE_BEHIND_PUT_TIMEOUT_SECONDS for room (backpressure) and the record is
+# dropped (counted) after that. A batch rejected for its data (a constraint or
+# bad value) is retried record by record so one bad row doesn't lose the rest;
+# any other failure (database down, connection lost) puts the batch back at the
+# head of the queue, still bounded by max_pending, and flushing backs off from
+# WRITE_BEHIND_FLUSH_MS up to WRITE_BEHIND_MAX_BACKOFF_SECONDS until a write
+# succeeds. close() flushes what is left.
+# ---------------------------------------------------------------------------
+import os
+import asyncio
+from sqlalchemy.exc import DataError, IntegrityError
+from metrics import Gauge, Counter, DB_QUERY_SECONDS
+
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 200))
+WRITE_BEHIND_FLUSH_MS = float(os.getenv("WRITE_BEHIND_FLUSH_MS", 250))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", 20000))
+WRITE_BEHIND_PUT_TIMEOUT_SECONDS = float(os.getenv("WRITE_BEHIND_PUT_TIMEOUT_SECONDS", 1.0))
+WRITE_BEHIND_MAX_BACKOFF_SECONDS = float(os.getenv("WRITE_BEHIND_MAX_BACKOFF_SECONDS", 30))
+
+WRITE_BEHIND_PENDING = Gauge("mf_write_behind_pending", "Records buffered and not yet written, by queue.", ["queue"])
+WRITE_BEHIND_RECORDS = Counter("mf_write_behind_records_total",
+                               "Records by queue and outcome (written, failed, dropped).", ["queue", "result"])
+WRITE_BEHIND_BATCHES = Counter("mf_write_behind_batches_total", "Flushed batches by queue.", ["queue"])
+
+
+def is_data_error(e):
+    """True if the rows themselves were rejected (SQLSTATE class 22/23), so retrying them as-is can't help."""
+    if isinstance(e, (DataError, IntegrityError)):
+        return True
+    code = getattr(getattr(e, "orig", None), "pgcode", None) or ""   # asyncpg surfaces some as plain DBAPIError
+    return code[:2] in ("22", "23")
+
+
+class WriteBehindQueue:
+    def __init__(self, name, writer, batch_size=WRITE_BEHIND_BATCH_SIZE, flush_ms=WRITE_BEHIND_FLUSH_MS,
+                 max_pending=WRITE_BEHIND_MAX_PENDING, put_timeout=WRITE_BEHIND_PUT_TIMEOUT_SECONDS):
+        self.name = name
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.max_pending = max_pending
+        self.put_timeout = put_timeout
+        self.pending = []
+        self.stats = {"written": 0, "failed": 0, "dropped": 0, "batches": 0, "retries": 0}
+        self.backoff = 0.0       # Seconds to wait before the next flush after a failed write
+        self._task = None
+        self._wakeup = None      # Set when a full batch is waiting
+        self._has_room = None    # Cleared while max_pending records are buffered
+        self._flush_lock = None
+        self._closing = False
+
+    def _start(self):
+        # Bound to the running loop on first use
+        self._wakeup = asyncio.Event()
+        self._has_room = asyncio.Event()
+        self._has_room.set()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, record):
+        """Buffer one record; waits for room when the queue is full, then drops it. Returns True if queued."""
+        if self._task is None:
+            self._start()
+        if len(self.pending) >= self.max_pending:
+            self._wakeup.set()
+            try:
+                while len(self.pending) >= self.max_pending:
+                    self._has_room.clear()
+                    await asyncio.wait_for(self._has_room.wait(), timeout=self.put_timeout)
+            except asyncio.TimeoutError:
+                self._count("dropped")
+                return False
+
+        self.pending.append(record)
+        WRITE_BEHIND_PENDING.set(len(self.pending), queue=self.name)
+        if len(self.pending) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while not self._closing:
+            # While backing off a full batch doesn't cut the wait short; close() does
+            deadline = loop.time() + (self.backoff or self.flush_interval)
+            while not self._closing:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+                self._wakeup.clear()
+                if not self.backoff:
+                    break
+            if self._closing:
+                break   # close() does the final flush
+            try:
+                await self.flush()
+            except Exception as e:   # Never let the flusher die
+                print(f"Write-behind queue '{self.name}' flush error: {e}")
+
+    async def flush(self):
+        """
+        Write everything buffered, batch_size records per transaction.
+        Stops early (records kept) when the database can't be written to.
+        """
+        async with self._flush_lock:
+            while self.pending:
+                batch = self.pending[:self.batch_size]
+                del self.pending[:self.batch_size]
+                self._pending_changed()
+                if not await self._write(batch):
+                    return
+
+    async def _write(self, batch):
+        """Write `batch`; False if it was put back to retry later."""
+        error = await self._try_write(batch)
+        if error is None:
+            return True
+        if not is_data_error(error):
+            self._requeue(batch, error)
+            return False
+        if len(batch) > 1:
+            print(f"Write-behind queue '{self.name}': batch of {len(batch)} rejected, retrying one by one: {error}")
+        for i, record in enumerate(batch):
+            error = await self._try_write([record]) if len(batch) > 1 else error
+            if error is None:
+                continue
+            if not is_data_error(error):
+                self._requeue(batch[i:], error)
+                return False
+            self._count("failed")
+            print(f"Write-behind queue '{self.name}': record failed ({self.stats['failed']} so far): {error}")
+        return True
+
+    async def _try_write(self, batch):
+        """Hand `batch` to the writer; the exception if it failed, else None."""
+        try:
+            with DB_QUERY_SECONDS.time(op=f'write_behind_{self.name}'):
+                await self.writer(batch)
+        except Exception as e:
+            return e
+        self.stats["batches"] += 1
+        WRITE_BEHIND_BATCHES.inc(queue=self.name)
+        self._count("written", len(batch))
+        self.backoff = 0.0
+        return None
+
+    def _requeue(self, batch, error):
+        """Put `batch` back at the head of the queue (dropping the newest records beyond max_pending) and back off."""
+        self.pending[:0] = batch
+        overflow = len(self.pending) - self.max_pending
+        if overflow > 0:
+            del self.pending[-overflow:]
+            self._count("dropped", overflow)
+        self._pending_changed()
+        self.stats["retries"] += 1
+        self.backoff = min(WRITE_BEHIND_MAX_BACKOFF_SECONDS, max(self.flush_interval, 2 * self.backoff))
+        print(f"Write-behind queue '{self.name}': write failed, {len(self.pending)} records kept, "
+              f"retrying in {self.backoff:.1f}s: {error}")
+
+    def _pending_changed(self):
+        WRITE_BEHIND_PENDING.set(len(self.pending), queue=self.name)
+        if len(self.pending) < self.max_pending:
+            self._has_room.set()
+
+    def status(self):
+        return dict(self.stats, pending=len(self.pending), max_pending=self.max_pending, backoff=self.backoff)
+
+    def _count(self, result, n=1):
+        self.stats[result] += n
+        WRITE_BEHIND_RECORDS.inc(n, queue=self.name, result=result)
+
+    async def close(self):
+        """Stop the flusher and write whatever is still buffered (app shutdown)."""
+        if self._task is None:
+            return
+        self._closing = True   # Let an in-progress batch finish rather than cancelling it mid-write
+        self._wakeup.set()
+        await self._task
+        await self.flush()
+        if self.pending:
+            print(f"Write-behind queue '{self.name}': {len(self.pending)} records not written at shutdown")
+        self._task = None
+        self._closing = False